@@ -0,0 +1,86 @@
+"""
+Benchmark the per-call overhead of the execution engine on trivial completions:
+
+    python benchmarks/engine_benchmark.py --repeat 20000
+
+Compares building the sandbox from scratch for every call (the previous behaviour:
+filtering builtins and exec'ing the imports) with cloning the prebuilt environment.
+"""
+
+import argparse
+import asyncio
+import timeit
+
+from dria_agent.pythonic.engine import (
+    DANGEROUS_BUILTINS,
+    _create_execution_env,
+    async_execute_python_code,
+    execute_python_code,
+)
+
+COMPLETIONS = {
+    "assignment": "x = 1",
+    "tool call": 'weather = get_weather("Istanbul")',
+}
+
+
+def get_weather(city: str) -> str:
+    return f"Sunny in {city}"
+
+
+async def async_get_weather(city: str) -> str:
+    return f"Sunny in {city}"
+
+
+def rebuilt_env(safe: bool = True) -> dict:
+    builtins_dict = (
+        __builtins__ if isinstance(__builtins__, dict) else __builtins__.__dict__
+    )
+    env = {"__builtins__": builtins_dict}
+    exec("from typing import List, Dict, Any, Union, Tuple, Callable", env)
+    exec("import re", env)
+    exec("from datetime import datetime, timedelta", env)
+    # Filtered after the imports, the sandbox has no __import__.
+    if safe:
+        env["__builtins__"] = {
+            k: v for k, v in builtins_dict.items() if k not in DANGEROUS_BUILTINS
+        }
+    return env
+
+
+def per_call_us(fn, repeat: int) -> float:
+    return min(timeit.repeat(fn, number=repeat, repeat=5)) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    print("environment setup")
+    for safe in (False, True):
+        rebuilt = per_call_us(lambda: rebuilt_env(safe), args.repeat)
+        cloned = per_call_us(lambda: _create_execution_env(safe), args.repeat)
+        print(f"  safe={safe!s:<6} rebuilt {rebuilt:8.2f} us   cloned {cloned:8.2f} us")
+
+    print("execute_python_code")
+    for name, code in COMPLETIONS.items():
+        us = per_call_us(lambda: execute_python_code(code, [get_weather]), args.repeat)
+        print(f"  {name:<12} {us:8.2f} us/call")
+
+    print("async_execute_python_code")
+    loop = asyncio.new_event_loop()
+    for name, code in COMPLETIONS.items():
+        code = code.replace("get_weather", "async_get_weather")
+        us = per_call_us(
+            lambda: loop.run_until_complete(
+                async_execute_python_code(code, [async_get_weather])
+            ),
+            args.repeat // 10,
+        )
+        print(f"  {name:<12} {us:8.2f} us/call")
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
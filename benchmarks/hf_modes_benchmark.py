@@ -0,0 +1,85 @@
+"""
+Benchmark peak memory and decoding speed of the HuggingFace backend on CPU for each
+weight mode, across the model sizes of ToolCallingAgent.MODE_MAP:
+
+    python benchmarks/hf_modes_benchmark.py --num_threads 8
+
+Every (model, mode) pair is loaded in a fresh process, so peak RSS is not shared
+between them. Results depend on the CPU and the thread count, and loading peaks are
+lower with accelerate installed (low_cpu_mem_usage).
+"""
+
+import argparse
+import multiprocessing
+import resource
+import sys
+import time
+
+MODES = {
+    "float32": {},
+    "bfloat16": {"dtype": "bfloat16"},
+    "int8 dynamic": {"quantize": "int8"},
+}
+
+QUERY = "What is the weather forecast for Istanbul for the next three days?"
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def measure(model: str, options: dict, args) -> tuple:
+    from dria_agent.agent.clients.hfc import HuggingfaceToolCallingAgent
+    from dria_agent.agent.metrics import collect_run
+    from dria_agent.agent.settings.generation import GenerationConfig
+
+    from prompt_benchmark import make_tool
+    from tooldb_benchmark import RandomEmbedding
+
+    agent = HuggingfaceToolCallingAgent(
+        RandomEmbedding(dim=64),
+        [make_tool(i) for i in range(4)],
+        model=model,
+        tokenizer=model,
+        prefix_cache_size=0,
+        num_threads=args.num_threads,
+        # Greedy and without stop sequences, every mode decodes max_tokens tokens.
+        generation_config=GenerationConfig(
+            max_tokens=args.max_tokens, stop=[], temperature=0.0
+        ),
+        **options,
+    )
+    prompt, _ = agent._prepare_messages(QUERY, num_tools=2)
+    agent._generate_content(prompt)  # warm up
+    with collect_run(agent.backend) as run:
+        start = time.perf_counter()
+        agent._generate_content(prompt)
+        elapsed = time.perf_counter() - start
+    return peak_rss_mb(), run.completion_tokens / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--max_tokens", type=int, default=64)
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    args = parser.parse_args()
+
+    from dria_agent.agent.agent import ToolCallingAgent
+
+    models = sorted(
+        {sizes["huggingface"][0] for sizes in ToolCallingAgent.MODE_MAP.values()}
+    )
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{'model':<32}{'mode':<16}{'peak RSS':>12}{'tokens/s':>10}")
+    for model in models:
+        for mode in args.modes:
+            with ctx.Pool(1) as pool:
+                rss, tps = pool.apply(measure, (model, MODES[mode], args))
+            print(f"{model:<32}{mode:<16}{rss:>9.0f} MB{tps:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark time-to-first-token of the HuggingFace backend with and without prompt
+prefix KV caching, on CPU:
+
+    python benchmarks/prefix_cache_benchmark.py --model driaforall/Tiny-Agent-a-0.5B
+
+Queries alternate between a few tool sets, so warm requests reuse either the cached
+system prompt of their tool set or the static instructions prefix.
+"""
+
+import argparse
+import statistics
+import time
+
+from dria_agent.agent.clients.hfc import HuggingfaceToolCallingAgent
+from dria_agent.agent.settings.generation import GenerationConfig
+
+from prompt_benchmark import make_tool
+from tooldb_benchmark import RandomEmbedding
+
+QUERIES = [
+    "What is the forecast for Istanbul?",
+    "Will it rain in Paris tomorrow?",
+    "How warm is it going to be in Tokyo this week?",
+    "Do I need an umbrella in London?",
+]
+
+
+def ttft(agent: HuggingfaceToolCallingAgent, prompts) -> list:
+    times = []
+    for prompt in prompts:
+        start = time.perf_counter()
+        agent._generate_content(prompt)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="driaforall/Tiny-Agent-a-0.5B")
+    parser.add_argument("--tools", type=int, default=12)
+    parser.add_argument("--tool_sets", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=12)
+    args = parser.parse_args()
+
+    tools = [make_tool(i) for i in range(args.tools)]
+    # One generated token, so the measured time is prefill + first decode step.
+    config = GenerationConfig(max_tokens=1, temperature=0.0)
+
+    results = {}
+    for name, size in [("no prefix cache", 0), ("prefix cache", 4)]:
+        agent = HuggingfaceToolCallingAgent(
+            RandomEmbedding(dim=64),
+            tools,
+            model=args.model,
+            tokenizer=args.model,
+            prefix_cache_size=size,
+            generation_config=config,
+        )
+        set_size = args.tools // args.tool_sets
+        prompts = []
+        for i in range(args.requests):
+            k = i % args.tool_sets
+            selected = tools[k * set_size : (k + 1) * set_size]
+            prompt, _ = agent._build_prompt(
+                agent._to_messages(QUERIES[i % len(QUERIES)]), selected
+            )
+            prompts.append(prompt)
+        times = ttft(agent, prompts)
+        # The first request of each tool set fills the cache.
+        results[name] = (times[0], statistics.median(times[args.tool_sets :]))
+
+    print(f"{'mode':<18}{'cold TTFT':>12}{'warm p50 TTFT':>16}")
+    for name, (cold, warm) in results.items():
+        print(f"{name:<18}{cold * 1000:>10.0f}ms{warm * 1000:>14.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
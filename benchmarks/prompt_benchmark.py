@@ -0,0 +1,58 @@
+"""
+Benchmark system prompt assembly for a few retrieved tools out of a large registry.
+
+Compares re-rendering every tool schema per request (the previous behaviour) with
+joining the schemas cached on each ToolCall:
+
+    python benchmarks/prompt_benchmark.py --tools 10000 --selected 5
+"""
+
+import argparse
+import random
+import timeit
+
+from dria_agent.agent.settings.prompt import render_system_prompt, system_prompt
+from dria_agent.agent.tool import tool
+
+
+def make_tool(i: int):
+    def func(city: str, days: int = 3, metric: bool = True) -> str:
+        pass
+
+    func.__name__ = f"get_forecast_{i}"
+    func.__doc__ = f"""
+    Get the weather forecast for a city, variant {i}.
+
+    :param city: The city to get the forecast for.
+    :param days: Number of days to forecast.
+    :param metric: Whether to use metric units.
+    :return: A description of the forecast.
+    """
+    return tool(func)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tools", type=int, default=10000)
+    parser.add_argument("--selected", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=10000)
+    args = parser.parse_args()
+
+    tools = [make_tool(i) for i in range(args.tools)]
+    selected = random.Random(0).sample(tools, args.selected)
+
+    def uncached():
+        tool_info = "\n".join(t._render() for t in selected)
+        return system_prompt.replace("{{functions_schema}}", tool_info)
+
+    def cached():
+        return render_system_prompt([t.schema for t in selected])
+
+    assert uncached() == cached()
+    for name, fn in [("re-render + replace", uncached), ("cached fragments", cached)]:
+        seconds = min(timeit.repeat(fn, number=args.repeat, repeat=5))
+        print(f"{name:<20} {seconds / args.repeat * 1e6:8.2f} us/prompt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Measure how much of each prompt an inference server's prompt cache can reuse, for
+each system prompt layout:
+
+    python benchmarks/prompt_cache_harness.py --tools 200 --requests 50
+
+Requests go over HTTP to a local stand-in for an OpenAI-compatible server. Like the
+prefix caches of vLLM and llama.cpp, it matches the tokens of each prompt against the
+prompts it has seen and reports the longest common prefix as cached tokens.
+"""
+
+import argparse
+import json
+import re
+import statistics
+import threading
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+from dria_agent.agent.clients.base import ToolCallingAgentBase
+from dria_agent.agent.clients.kv_cache import common_prefix_length
+
+from prompt_benchmark import make_tool
+from tooldb_benchmark import RandomEmbedding
+
+TOKEN = re.compile(r"\w+|[^\w\s]|\s+")
+
+QUERIES = [
+    "What is the forecast for {}?",
+    "Will it rain in {} tomorrow?",
+    "How warm is it going to be in {} this week?",
+    "Do I need an umbrella in {}?",
+]
+CITIES = ["Istanbul", "Paris", "Tokyo", "London", "Lima", "Oslo", "Cairo"]
+
+
+def tokenize(messages: List[Dict]) -> List[str]:
+    text = "".join(
+        f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages
+    )
+    return TOKEN.findall(text + "<|im_start|>assistant\n")
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Chat completions endpoint with a prefix cache of the last cache_size prompts."""
+
+    def __init__(self, cache_size: int = 16):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.prompts = deque(maxlen=cache_size)
+        self.lock = threading.Lock()
+
+    def cached_tokens(self, tokens: List[str]) -> int:
+        with self.lock:
+            hit = max(
+                (common_prefix_length(tokens, p) for p in self.prompts), default=0
+            )
+            self.prompts.append(tokens)
+        return hit
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        tokens = tokenize(body["messages"])
+        payload = json.dumps(
+            {
+                "choices": [
+                    {"message": {"role": "assistant", "content": "```python\n```"}}
+                ],
+                "usage": {
+                    "prompt_tokens": len(tokens),
+                    "completion_tokens": 3,
+                    "prompt_tokens_details": {
+                        "cached_tokens": self.server.cached_tokens(tokens)
+                    },
+                },
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInToolCallingAgent(ToolCallingAgentBase):
+    backend = "stand-in"
+
+    def __init__(self, embedding, tools, url: str, **kwargs):
+        super().__init__(embedding, tools, model="stand-in", **kwargs)
+        self.url = url
+        self.usage: List[Dict] = []
+
+    def _generate_content(self, messages: List[Dict]) -> str:
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({"model": self.model, "messages": messages}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            body = json.load(response)
+        self.usage.append(body["usage"])
+        return body["choices"][0]["message"]["content"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tools", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--num_tools", type=int, default=3)
+    args = parser.parse_args()
+
+    tools = [make_tool(i) for i in range(args.tools)]
+    queries = [
+        QUERIES[i % len(QUERIES)].format(CITIES[i % len(CITIES)])
+        for i in range(args.requests)
+    ]
+
+    print(f"{'layout':<14}{'prompt tokens':>15}{'cached p50':>12}{'cached min':>12}")
+    for layout in ("inline", "static_first"):
+        server = StandInServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        agent = StandInToolCallingAgent(
+            RandomEmbedding(dim=64),
+            tools,
+            url=f"http://127.0.0.1:{server.server_port}/v1/chat/completions",
+            prompt_layout=layout,
+        )
+        for query in queries:
+            agent.run(
+                query, dry_run=True, show_completion=False, num_tools=args.num_tools
+            )
+        server.shutdown()
+
+        # The first request has nothing to reuse.
+        warm = agent.usage[1:]
+        prompt = statistics.median(u["prompt_tokens"] for u in warm)
+        cached = [u["prompt_tokens_details"]["cached_tokens"] for u in warm]
+        print(
+            f"{layout:<14}{prompt:>15.0f}{statistics.median(cached):>12.0f}"
+            f"{min(cached):>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
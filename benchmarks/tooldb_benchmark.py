@@ -0,0 +1,90 @@
+"""
+Benchmark ToolDB.nearest latency for each index type.
+
+Uses a synthetic embedding so no model has to be downloaded:
+
+    python benchmarks/tooldb_benchmark.py --sizes 1000 10000 100000
+"""
+
+import argparse
+import time
+import zlib
+
+import numpy as np
+
+from dria_agent.agent.embedder import BaseEmbedding
+from dria_agent.agent.vdb import ToolDB
+
+
+class RandomEmbedding(BaseEmbedding):
+    """Clustered random vectors, deterministic for a given text."""
+
+    def __init__(self, dim: int = 768, clusters: int = 64):
+        # Queries repeat across sizes, keep them uncached to time the full path.
+        super().__init__("random", dim, query_cache_size=0)
+        rng = np.random.default_rng(0)
+        self.centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+
+    def _vector(self, text: str) -> np.ndarray:
+        rng = np.random.default_rng(zlib.crc32(text.encode()))
+        center = self.centers[rng.integers(len(self.centers))]
+        return center + 0.5 * rng.standard_normal(self.dim).astype(np.float32)
+
+    def batch_embed(self, texts):
+        return np.stack([self._vector(str(t)) for t in texts])
+
+    def _embed_query(self, text: str) -> np.ndarray:
+        return self._vector(text)
+
+
+def bench(
+    index: str, size: int, embedding: RandomEmbedding, queries: list[str], k: int
+):
+    db = ToolDB(embedding=embedding, index=index)
+    start = time.perf_counter()
+    for i in range(0, size, 1000):
+        db.add([f"tool_{j}" for j in range(i, min(i + 1000, size))])
+    build = time.perf_counter() - start
+
+    timings, results = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(db.nearest(q, k=k))
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1000
+    return build, np.percentile(timings, 50), np.percentile(timings, 99), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--indexes", nargs="+", default=["flat", "hnsw"])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=768)
+    args = parser.parse_args()
+
+    embedding = RandomEmbedding(dim=args.dim)
+    queries = [f"tool_{i}" for i in range(args.queries)]
+
+    print(
+        f"{'index':<6} {'tools':>7} {'build s':>8} {'p50 ms':>8} {'p99 ms':>8} {'recall':>7}"
+    )
+    for size in args.sizes:
+        exact = None
+        for index in args.indexes:
+            build, p50, p99, results = bench(index, size, embedding, queries, args.k)
+            if index == "flat":
+                exact = results
+            recall = (
+                np.mean([len(set(a) & set(b)) / args.k for a, b in zip(results, exact)])
+                if exact is not None
+                else float("nan")
+            )
+            print(
+                f"{index:<6} {size:>7} {build:>8.2f} {p50:>8.3f} {p99:>8.3f} {recall:>7.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
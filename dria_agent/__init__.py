@@ -1,3 +1,5 @@
 from .agent import ToolCallingAgent, tool
+from .agent.settings.generation import GenerationConfig
+from .pythonic.schemas import ExecutionLimits
 
-__all__ = ["ToolCallingAgent", "tool"]
+__all__ = ["ToolCallingAgent", "tool", "GenerationConfig", "ExecutionLimits"]
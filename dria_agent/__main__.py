@@ -5,6 +5,7 @@ import sys
 from rich.console import Console
 
 from dria_agent import ToolCallingAgent
+from dria_agent.agent.cache import DEFAULT_CACHE_DIR
 from dria_agent.tools import (
     APPLE_TOOLS,
     API_TOOLS,
@@ -38,6 +39,25 @@ async def async_chat_mode(agent):
         await agent.close_servers()
 
 
+async def async_warm_cache(agent):
+    try:
+        await agent.initialize_servers()
+    finally:
+        await agent.close_servers()
+
+
+async def async_serve_mode(agent, args):
+    from dria_agent.server import AgentServer
+
+    server = AgentServer(
+        agent,
+        host=args.host,
+        port=args.port,
+        max_concurrency=args.max_concurrency,
+    )
+    await server.serve_forever()
+
+
 def chat_mode(agent):
     console.print(
         "Chat mode. Type 'exit' to quit. Type 'clear' to clear the screen.",
@@ -48,7 +68,9 @@ def chat_mode(agent):
 
 def main():
     parser = argparse.ArgumentParser(description="dria_agent CLI tool.")
-    parser.add_argument("query", nargs="*", help="Query string")
+    parser.add_argument(
+        "query", nargs="*", help="Query string, or 'serve' to start the HTTP server"
+    )
     parser.add_argument("--chat", action="store_true", help="Enable chat mode")
     parser.add_argument(
         "--mcp_path",
@@ -67,8 +89,38 @@ def main():
         default="performant",
         help="Select agent mode",
     )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        help="Directory for the on-disk tool embedding cache",
+    )
+    parser.add_argument(
+        "--warm_cache",
+        action="store_true",
+        help="Embed all tools into the embedding cache and exit",
+    )
+    parser.add_argument(
+        "--host", type=str, default="127.0.0.1", help="Host for serve mode"
+    )
+    parser.add_argument("--port", type=int, default=8000, help="Port for serve mode")
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=4,
+        help="Maximum number of concurrent requests in serve mode",
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=1,
+        help="Micro-batch up to this many concurrent generations in serve mode",
+    )
     args = parser.parse_args()
 
+    cache_dir = args.cache_dir
+    if args.warm_cache and cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+
     all_tools = (
         APPLE_TOOLS + API_TOOLS + MATH_TOOLS + SLACK_TOOLS + DOCKER_TOOLS + SEARCH_TOOLS
     )
@@ -76,14 +128,28 @@ def main():
     try:
         if args.mcp_path:
             agent = ToolCallingAgent(
-                mcp_file=args.mcp_path, backend=args.backend, mode=args.agent_mode
+                mcp_file=args.mcp_path,
+                backend=args.backend,
+                mode=args.agent_mode,
+                cache_dir=cache_dir,
+                max_batch_size=args.max_batch_size,
             )
         else:
             agent = ToolCallingAgent(
-                tools=all_tools, backend=args.backend, mode=args.agent_mode
+                tools=all_tools,
+                backend=args.backend,
+                mode=args.agent_mode,
+                cache_dir=cache_dir,
+                max_batch_size=args.max_batch_size,
             )
 
-        if args.mcp_path and args.chat:
+        if args.warm_cache:
+            if args.mcp_path:
+                asyncio.run(async_warm_cache(agent))
+            console.print(f"Embedding cache warmed at {cache_dir}", style="bold green")
+        elif args.query == ["serve"]:
+            asyncio.run(async_serve_mode(agent, args))
+        elif args.mcp_path and args.chat:
             asyncio.run(async_chat_mode(agent))
         elif args.mcp_path and args.query:
             query = " ".join(args.query)
@@ -1,4 +1,6 @@
 from .agent import ToolCallingAgent
 from .tool import tool
+from .settings.generation import GenerationConfig
+from dria_agent.pythonic.schemas import ExecutionLimits
 
-__all__ = ["ToolCallingAgent", "tool"]
+__all__ = ["ToolCallingAgent", "tool", "GenerationConfig", "ExecutionLimits"]
@@ -1,12 +1,15 @@
 import copy
 import logging
-from typing import List, Literal, Callable
+from typing import List, Literal, Callable, AsyncIterator
 
 from rich.console import Console
 from rich.logging import RichHandler
 
+from dria_agent.agent.metrics import METRICS, start_metrics_server
+from dria_agent.agent.registry import MODELS
+from dria_agent.agent.settings.generation import GenerationConfig
 from dria_agent.agent.settings.providers import PROVIDER_URLS
-from dria_agent.pythonic.schemas import ExecutionResults
+from dria_agent.pythonic.schemas import ExecutionLimits, ExecutionResults, StreamEvent
 from .checkers import check_and_install_ollama
 from .mcp import MCPToolAdapter
 from .utils import *
@@ -109,6 +112,13 @@ class ToolCallingAgent(object):
         tools: Optional[List] = None,
         backend: str = "ollama",
         mode: Literal["ultra_light", "fast", "balanced", "performant"] = "performant",
+        index: Literal["flat", "hnsw"] = "flat",
+        cache_dir: Optional[str] = None,
+        metrics_port: Optional[int] = None,
+        generation_config: Optional[GenerationConfig] = None,
+        prompt_layout: Literal["inline", "static_first"] = "inline",
+        execution_limits: Optional[ExecutionLimits] = None,
+        parallel_tool_calls: bool = True,
         **kwargs,
     ):
         if mcp_file is None and tools is None:
@@ -146,8 +156,22 @@ class ToolCallingAgent(object):
                 model_name=model_pairs[1], dim=self.embedding_dims[model_pairs[1]]
             ),
             tools=tools,
+            index=index,
+            cache_dir=cache_dir,
+            generation_config=generation_config,
+            prompt_layout=prompt_layout,
+            execution_limits=execution_limits,
+            parallel_tool_calls=parallel_tool_calls,
             **kwargs,
         )
+        self.metrics_server = (
+            start_metrics_server(metrics_port) if metrics_port is not None else None
+        )
+
+    @staticmethod
+    def metrics() -> dict:
+        """Snapshot of the process-wide counters and histograms."""
+        return METRICS.snapshot()
 
     async def initialize_servers(self):
         """Asynchronously initialize the agent, including connecting to the MCP server."""
@@ -157,7 +181,17 @@ class ToolCallingAgent(object):
 
     async def close_servers(self):
         """Close the MCP server connection."""
-        await self._mcp_adapter.close_servers()
+        if self._mcp_adapter:
+            await self._mcp_adapter.close_servers()
+
+    def close(self):
+        """Release the models of the agent, unloading those no other agent uses."""
+        self.agent.close()
+
+    @staticmethod
+    def loaded_models() -> List[dict]:
+        """Models loaded in the process, with their reference counts and memory."""
+        return MODELS.info()
 
     @staticmethod
     def _print_execution_results(execution: ExecutionResults, query: str) -> None:
@@ -180,6 +214,8 @@ class ToolCallingAgent(object):
         show_completion: bool = True,
         num_tools: int = 2,
         print_results: bool = True,
+        limits: Optional[ExecutionLimits] = None,
+        parallel: Optional[bool] = None,
     ) -> ExecutionResults:
         """
         Run the agent synchronously with the given query.
@@ -190,17 +226,66 @@ class ToolCallingAgent(object):
             show_completion: Whether to show the agent's completion
             num_tools: Number of tools to use for the query
             print_results: Whether to print execution results
+            limits: Timeouts and resource limits of the tool execution, exceeded ones
+                are reported as TimeoutError entries of ExecutionResults.errors
+            parallel: Whether independent tool calls run concurrently, defaults to
+                the agent's parallel_tool_calls
 
         Returns:
             ExecutionResults containing the execution outcome
         """
         execution = self.agent.run(
-            query, dry_run=dry_run, show_completion=show_completion, num_tools=num_tools
+            query,
+            dry_run=dry_run,
+            show_completion=show_completion,
+            num_tools=num_tools,
+            limits=limits,
+            parallel=parallel,
         )
         if print_results:
             self._print_execution_results(execution, query)
         return execution
 
+    def run_batch(
+        self,
+        queries: List[str],
+        dry_run: bool = False,
+        show_completion: bool = True,
+        num_tools: int = 2,
+        print_results: bool = True,
+        limits: Optional[ExecutionLimits] = None,
+        parallel: Optional[bool] = None,
+    ) -> List[ExecutionResults]:
+        """
+        Run the agent on several queries, retrieving tools for all of them in one batch.
+
+        Args:
+            queries: The query strings to process
+            dry_run: If True, don't execute tools, just return planned execution
+            show_completion: Whether to show the agent's completion
+            num_tools: Number of tools to use for each query
+            print_results: Whether to print execution results
+            limits: Timeouts and resource limits of the tool execution, exceeded ones
+                are reported as TimeoutError entries of ExecutionResults.errors
+            parallel: Whether independent tool calls run concurrently, defaults to
+                the agent's parallel_tool_calls
+
+        Returns:
+            ExecutionResults for each query, in order
+        """
+        executions = self.agent.run_batch(
+            queries,
+            dry_run=dry_run,
+            show_completion=show_completion,
+            num_tools=num_tools,
+            limits=limits,
+            parallel=parallel,
+        )
+        if print_results:
+            for query, execution in zip(queries, executions):
+                self._print_execution_results(execution, query)
+        return executions
+
     async def async_run(
         self,
         query: str,
@@ -208,6 +293,8 @@ class ToolCallingAgent(object):
         show_completion: bool = True,
         num_tools: int = 2,
         print_results: bool = True,
+        limits: Optional[ExecutionLimits] = None,
+        parallel: Optional[bool] = None,
     ) -> ExecutionResults:
         """
         Run the agent asynchronously with the given query.
@@ -218,18 +305,59 @@ class ToolCallingAgent(object):
             show_completion: Whether to show the agent's completion
             num_tools: Number of tools to use for the query
             print_results: Whether to print execution results
+            limits: Timeouts and resource limits of the tool execution, exceeded ones
+                are reported as TimeoutError entries of ExecutionResults.errors
+            parallel: Whether independent tool calls run concurrently, defaults to
+                the agent's parallel_tool_calls
 
         Returns:
             ExecutionResults containing the execution outcome
         """
 
         execution = await self.agent.async_run(
-            query, dry_run=dry_run, show_completion=show_completion, num_tools=num_tools
+            query,
+            dry_run=dry_run,
+            show_completion=show_completion,
+            num_tools=num_tools,
+            limits=limits,
+            parallel=parallel,
         )
         if print_results:
             self._print_execution_results(execution, query)
         return execution
 
+    def stream_run(
+        self,
+        query: str,
+        dry_run: bool = False,
+        num_tools: int = 2,
+        limits: Optional[ExecutionLimits] = None,
+        parallel: Optional[bool] = None,
+    ) -> AsyncIterator[StreamEvent]:
+        """
+        Run the agent while streaming the completion. Generation stops as soon as the
+        python code block is closed, and the code is executed right away.
+
+        Args:
+            query: The query string to process
+            dry_run: If True, stop after the code_ready event without executing tools
+            num_tools: Number of tools to use for the query
+            limits: Timeouts and resource limits of the tool execution
+            parallel: Whether independent tool calls run concurrently, defaults to
+                the agent's parallel_tool_calls
+
+        Returns:
+            Async iterator of StreamEvent with type token, code_ready, tool_result and
+            final (whose data is the ExecutionResults)
+        """
+        return self.agent.stream_run(
+            query,
+            dry_run=dry_run,
+            num_tools=num_tools,
+            limits=limits,
+            parallel=parallel,
+        )
+
     def run_feedback(
         self,
         query: str,
@@ -562,3 +690,13 @@ class ToolCallingAgent(object):
             message: The message to respond to
         """
         return self.agent.instruct(message, show_completion=True)
+
+    async def async_instruct(self, message: str, show_completion: bool = True):
+        """
+        Asynchronous instruct mode for agent, no tool calls.
+
+        Args:
+            message: The message to respond to
+            show_completion: Whether to show the agent's completion
+        """
+        return await self.agent.async_instruct(message, show_completion=show_completion)
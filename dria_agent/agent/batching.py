@@ -0,0 +1,92 @@
+"""
+Dynamic micro-batching of work submitted by concurrent coroutines.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dria_agent.agent.metrics import METRICS, collect_batch, current_run
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class MicroBatcher:
+    """
+    Collects items from concurrent callers and processes them in batches.
+
+    A batch is processed once max_batch_size items are waiting or max_wait_ms has
+    passed since the first of them arrived, whichever comes first. Larger batches
+    amortize more work per call, longer waits add latency to every request.
+
+    The batch is processed under collect_batch with the run of each caller, so the
+    process function can attribute metrics to individual items with batch_item(i).
+
+    :param process: Coroutine function mapping a list of items to a list of results.
+    :param max_batch_size: Maximum number of items in a batch.
+    :param max_wait_ms: Maximum time the first item of a batch waits for others.
+    :param labels: Labels of the batch size metric.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+        labels: Optional[Dict[str, str]] = None,
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.process = process
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.labels = labels or {}
+        self._pending: List[Tuple[Any, asyncio.Future, Any]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    async def submit(self, item: Any) -> Any:
+        """Add an item to the next batch and wait for its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, current_run()))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[: self.max_batch_size]
+            del self._pending[: self.max_batch_size]
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future, Any]]) -> None:
+        items, futures, runs = zip(*batch)
+        METRICS.observe(
+            "dria_agent_batch_size",
+            len(items),
+            buckets=BATCH_SIZE_BUCKETS,
+            **self.labels,
+        )
+        try:
+            with collect_batch(list(runs)):
+                results = await self.process(list(items))
+            if len(results) != len(items):
+                raise RuntimeError(
+                    f"Batch of {len(items)} items returned {len(results)} results"
+                )
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,284 @@
+"""
+Caches for embeddings: an in-memory LRU and a persistent, content-addressed store.
+"""
+
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the cache is only safe to share between threads of one process.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "DRIA_AGENT_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "dria_agent")
+)
+
+
+class LRUCache:
+    """
+    Thread-safe, bounded least recently used cache with an optional time-to-live.
+
+    :param maxsize: Maximum number of entries.
+    :param ttl: Optional lifetime of an entry in seconds.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 256, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, self._MISSING)
+            if item is not self._MISSING and (
+                self.ttl is None or time.monotonic() - item[1] < self.ttl
+            ):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            if item is not self._MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+
+class EmbeddingCache:
+    """
+    Embeddings stored in a memory-mapped .npy file with a JSON sidecar index.
+
+    Entries are keyed by a hash of the embedding model name, dimension and text, and
+    the least recently used entries are evicted once max_entries is reached.
+
+    Processes sharing a cache directory coordinate through a file lock: the sidecar is
+    re-read under the lock before rows are looked up or assigned, and written back by
+    every put, so workers never hand out each other's rows.
+
+    :param model_name: Name of the embedding model.
+    :param dim: Embedding dimension.
+    :param cache_dir: Root directory of the cache, defaults to ~/.cache/dria_agent.
+    :param max_entries: Maximum number of cached embeddings per model.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        dim: int,
+        cache_dir: Optional[str] = None,
+        max_entries: int = 50000,
+    ):
+        self.model_name = model_name
+        self.dim = dim
+        self.max_entries = max_entries
+        slug = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+        self.path = os.path.join(cache_dir or DEFAULT_CACHE_DIR, f"{slug}-{dim}")
+        self._vectors_path = os.path.join(self.path, "vectors.npy")
+        self._index_path = os.path.join(self.path, "index.json")
+        self._lock_path = os.path.join(self.path, "lock")
+        os.makedirs(self.path, exist_ok=True)
+
+        # key -> [row, last_used]
+        self._entries: Dict[str, List[int]] = {}
+        self._free: List[int] = []
+        self._clock = 0
+        # Identity of the files this process last read, to reload them on change.
+        self._vectors_ino = None
+        self._index_stamp = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @contextmanager
+    def _locked(self):
+        """Hold the cache lock of this process and, where available, of the directory."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._lock_path, "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self) -> None:
+        with self._locked():
+            self._refresh()
+
+    def _open_vectors(self) -> None:
+        """Map vectors.npy, creating it if it is missing or does not match."""
+        try:
+            vectors = np.load(self._vectors_path, mmap_mode="r+")
+            if vectors.shape != (self.max_entries, self.dim):
+                raise ValueError(f"Cache shape {vectors.shape} does not match")
+        except (OSError, ValueError) as e:
+            if os.path.exists(self._vectors_path):
+                logger.info(f"Resetting embedding cache at {self.path}: {e}")
+            # Created aside and moved in place rather than truncating the file, so
+            # processes still mapping the old one keep reading valid memory.
+            tmp_path = f"{self._vectors_path}.{os.getpid()}.tmp"
+            vectors = np.lib.format.open_memmap(
+                tmp_path,
+                mode="w+",
+                dtype=np.float32,
+                shape=(self.max_entries, self.dim),
+            )
+            vectors.flush()
+            os.replace(tmp_path, self._vectors_path)
+            # Rows of the old index point into the old file.
+            self._entries = {}
+            self._write_index()
+            self._index_stamp = None
+        self._vectors = vectors
+        self._vectors_ino = os.stat(self._vectors_path).st_ino
+
+    def _refresh(self) -> None:
+        """Reload the files if another process changed them, call with the lock held."""
+        try:
+            vectors_ino = os.stat(self._vectors_path).st_ino
+        except OSError:
+            vectors_ino = None
+        if vectors_ino is None or vectors_ino != self._vectors_ino:
+            self._open_vectors()
+
+        try:
+            st = os.stat(self._index_path)
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        if stamp is not None and stamp == self._index_stamp:
+            return
+        try:
+            with open(self._index_path, "r") as f:
+                index = json.load(f)
+            entries, clock = index["entries"], index["clock"]
+        except (OSError, ValueError, KeyError):
+            entries, clock = {}, 0
+        # Rows come from disk, recency is the latest of the two views.
+        for k, entry in entries.items():
+            local = self._entries.get(k)
+            if local is not None and local[0] == entry[0]:
+                entry[1] = max(entry[1], local[1])
+        self._entries = entries
+        self._clock = max(self._clock, clock)
+        self._index_stamp = stamp
+
+        used = {row for row, _ in self._entries.values()}
+        self._free = [
+            row for row in range(self.max_entries - 1, -1, -1) if row not in used
+        ]
+
+    def _write_index(self) -> None:
+        """Write the sidecar index atomically, call with the lock held."""
+        tmp_path = f"{self._index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"clock": self._clock, "entries": self._entries}, f)
+        os.replace(tmp_path, self._index_path)
+        st = os.stat(self._index_path)
+        self._index_stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, text: str) -> str:
+        content = f"{self.model_name}\0{self.dim}\0{text}"
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Look up texts, returns a vector for each hit and None for each miss."""
+        results = []
+        with self._locked():
+            self._refresh()
+            for text in texts:
+                entry = self._entries.get(self.key(text))
+                if entry is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self._clock += 1
+                entry[1] = self._clock
+                results.append(np.array(self._vectors[entry[0]]))
+        return results
+
+    def put(self, texts: List[str], vectors: np.ndarray) -> None:
+        """Store vectors for texts, evicting least recently used entries if full."""
+        texts, vectors = texts[-self.max_entries :], vectors[-self.max_entries :]
+        keys = [self.key(t) for t in texts]
+        batch = set(keys)
+        with self._locked():
+            self._refresh()
+            evict = len(batch - self._entries.keys()) - len(self._free)
+            if evict > 0:
+                victims = heapq.nsmallest(
+                    evict,
+                    (k for k in self._entries if k not in batch),
+                    key=lambda k: self._entries[k][1],
+                )
+                for k in victims:
+                    self._free.append(self._entries.pop(k)[0])
+
+            for k, v in zip(keys, vectors):
+                self._clock += 1
+                if k in self._entries:
+                    self._entries[k][1] = self._clock
+                else:
+                    self._entries[k] = [self._free.pop(), self._clock]
+                self._vectors[self._entries[k][0]] = v
+            # Rows are claimed on disk right away, before other processes refresh.
+            self._vectors.flush()
+            self._write_index()
+
+    def flush(self) -> None:
+        """Persist vectors and the sidecar index, with the recency of cache hits."""
+        with self._locked():
+            self._refresh()
+            self._vectors.flush()
+            self._write_index()
@@ -1,15 +1,18 @@
+from dria_agent.agent.metrics import record_tokens
 from dria_agent.agent.settings.providers import PROVIDER_URLS
-from typing import List, Dict
+from typing import List, Dict, AsyncIterator
 
 
 class OpenAICompatible:
     def __init__(self):
         # Initialize OpenAI clients for each provider
-        from openai import OpenAI
+        from openai import OpenAI, AsyncOpenAI
 
         self.CLIENTS = {}
+        self.ASYNC_CLIENTS = {}
         for provider, (url, api_key) in PROVIDER_URLS.items():
             self.CLIENTS[provider] = OpenAI(api_key=api_key, base_url=url)
+            self.ASYNC_CLIENTS[provider] = AsyncOpenAI(api_key=api_key, base_url=url)
 
     def get_completion(
         self,
@@ -42,8 +45,85 @@ class OpenAICompatible:
             response = client.chat.completions.create(
                 model=model_name, messages=messages, temperature=0.0
             )
+        if response.usage is not None:
+            record_tokens(
+                response.usage.prompt_tokens, response.usage.completion_tokens
+            )
+        return response.choices[0].message.content
+
+    async def async_get_completion(
+        self,
+        model_name: str,
+        provider: str,
+        messages: List[Dict[str, str]],
+        options=None,
+    ) -> str:
+        """
+        Asynchronously get a completion from a model for a given provider.
+
+        Args:
+            model_name: The name of the model to use
+            provider: The provider to use
+            messages: The chat messages to complete
+            options: Extra completion parameters
+
+        Returns:
+            The completion from the model
+        """
+        client = self.ASYNC_CLIENTS.get(provider)
+        if not client:
+            raise ValueError(f"Provider '{provider}' not recognized.")
+
+        response = await client.chat.completions.create(
+            model=model_name, messages=messages, **(options or {"temperature": 0.0})
+        )
+        if response.usage is not None:
+            record_tokens(
+                response.usage.prompt_tokens, response.usage.completion_tokens
+            )
         return response.choices[0].message.content
 
+    async def async_stream_completion(
+        self,
+        model_name: str,
+        provider: str,
+        messages: List[Dict[str, str]],
+        options=None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream a completion from a model for a given provider.
+
+        Args:
+            model_name: The name of the model to use
+            provider: The provider to use
+            messages: The chat messages to complete
+            options: Extra completion parameters
+
+        Yields:
+            Chunks of the completion as they are generated
+        """
+        client = self.ASYNC_CLIENTS.get(provider)
+        if not client:
+            raise ValueError(f"Provider '{provider}' not recognized.")
+
+        stream = await client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            stream=True,
+            **(options or {"temperature": 0.0}),
+        )
+        # Not every provider reports usage on streams, count chunks as completion tokens.
+        chunks = 0
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks += 1
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Closing the response makes the server stop generating.
+            await stream.close()
+            record_tokens(0, chunks)
+
     def embed(
         self, model_name: str, provider: str, texts: List[str], options: dict = None
     ) -> List[List[float]]:
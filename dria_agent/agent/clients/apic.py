@@ -1,65 +1,41 @@
-from typing import List, Union, Dict, Tuple, Callable
-
-from rich.console import Console
-from rich.panel import Panel
+from typing import List, Dict, Optional, AsyncIterator
 
 from dria_agent.agent.clients.base import ToolCallingAgentBase
-from dria_agent.agent.settings.prompt import system_prompt
-from dria_agent.pythonic.engine import execute_tool_call, async_execute_tool_call
-from dria_agent.pythonic.schemas import ExecutionResults
+from dria_agent.agent.settings.generation import CODE_FENCE_STOP, GenerationConfig
 from .api import OpenAICompatible
 
 
 class ApiToolCallingAgent(ToolCallingAgentBase):
+    backend = "api"
+    default_generation = GenerationConfig(stop=[CODE_FENCE_STOP], temperature=0.0)
+    # Generation runs remotely, async calls go through AsyncOpenAI.
+    generation_workers = 4
+
     def __init__(
         self,
         embedding,
         tools: List,
         model: str = "driaforall/Tiny-Agent-a-3B",
+        provider: Optional[str] = None,
         **kwargs
     ):
-        super().__init__(embedding, tools, model)
-        self.provider = kwargs["provider"]
+        super().__init__(embedding, tools, model, **kwargs)
+        self.provider = provider
         self.client = OpenAICompatible()
 
-    def _prepare_messages(
-        self, query: Union[str, List[Dict]], num_tools: int
-    ) -> Tuple[List, List[Callable]]:
-        """Prepare messages and tools for execution"""
-        if num_tools <= 0 or num_tools > 5:
-            raise RuntimeError(
-                "Number of tools cannot be less than 0 or greater than 3 for optimal performance"
-            )
-
-        messages = (
-            [{"role": "user", "content": query}]
-            if isinstance(query, str)
-            else query.copy()
-        )
-
-        # Get search query from user messages
-        user_msgs = [m["content"] for m in messages if m["role"] == "user"]
-        search_query = (
-            user_msgs[-2]
-            if "Please re-think your response and fix errors" in user_msgs[-1]
-            else user_msgs[-1]
-        )
-
-        # Get relevant tools
-        inds = self.db.nearest(search_query, k=num_tools)
-        tools = [list(self.tools.values())[ind] for ind in inds]
-        tool_info = "\n".join(str(tool) for tool in tools)
-
-        # Add system message
-        messages.insert(
-            0,
-            {
-                "role": "system",
-                "content": system_prompt.replace("{{functions_schema}}", tool_info),
-            },
-        )
-
-        return messages, [t.func for t in tools]
+    @property
+    def options(self) -> Dict:
+        """Completion options of the current generation config"""
+        options = {
+            "max_tokens": self.generation.max_tokens,
+            "stop": self.generation.stop,
+            "temperature": self.generation.temperature,
+        }
+        options = {k: v for k, v in options.items() if v is not None}
+        if self.generation.min_p is not None:
+            # Not part of the OpenAI API, understood by vLLM and LM Studio.
+            options["extra_body"] = {"min_p": self.generation.min_p}
+        return options
 
     def _generate_content(self, messages: List[Dict]) -> str:
         """Generate content from messages"""
@@ -67,69 +43,24 @@ class ApiToolCallingAgent(ToolCallingAgentBase):
             model_name=self.model,
             provider=self.provider,
             messages=messages,
-            options={"temperature": 0.0},
+            options=self.options,
         )
 
-    def _display_completion(self, content: str) -> None:
-        """Display completion in console"""
-        console = Console()
-        console.rule("[bold blue]Agent Response")
-        panel = Panel(content, title="Agent", subtitle="End of Response", expand=False)
-        console.print(panel)
-        console.rule()
-
-    def run(
-        self,
-        query: Union[str, List[Dict]],
-        dry_run: bool = False,
-        show_completion: bool = True,
-        num_tools: int = 2,
-    ) -> ExecutionResults:
-        """Run agent synchronously"""
-        messages, tools = self._prepare_messages(query, num_tools)
-        content = self._generate_content(messages)
-
-        if show_completion:
-            self._display_completion(content)
-
-        if dry_run:
-            return ExecutionResults(
-                content=content, results={}, data={}, errors=[], is_dry=True
-            )
-
-        return execute_tool_call(completion=content, functions=tools)
-
-    async def async_run(
-        self,
-        query: Union[str, List[Dict]],
-        dry_run: bool = False,
-        show_completion: bool = True,
-        num_tools: int = 2,
-    ) -> ExecutionResults:
-        """Run agent asynchronously"""
-        messages, tools = self._prepare_messages(query, num_tools)
-        content = self._generate_content(messages)
-
-        if show_completion:
-            self._display_completion(content)
-
-        if dry_run:
-            return ExecutionResults(
-                content=content, results={}, data={}, errors=[], is_dry=True
-            )
-
-        return await async_execute_tool_call(completion=content, functions=tools)
-
-    def instruct(self, query: Union[str, List[Dict]], show_completion: bool = False):
-
-        messages = (
-            [{"role": "user", "content": query}]
-            if isinstance(query, str)
-            else query.copy()
+    async def _async_generate_content(self, messages: List[Dict]) -> str:
+        """Generate content from messages with the async OpenAI client"""
+        return await self.client.async_get_completion(
+            model_name=self.model,
+            provider=self.provider,
+            messages=messages,
+            options=self.options,
         )
 
-        content = self._generate_content(messages)
-        if show_completion:
-            self._display_completion("Instruct Mode: \n\n" + content)
-
-        return content
+    async def _async_stream_content(self, messages: List[Dict]) -> AsyncIterator[str]:
+        """Stream content from messages with the async OpenAI client"""
+        async for chunk in self.client.async_stream_completion(
+            model_name=self.model,
+            provider=self.provider,
+            messages=messages,
+            options=self.options,
+        ):
+            yield chunk
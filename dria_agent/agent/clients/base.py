@@ -1,47 +1,424 @@
+import asyncio
+import contextvars
+import time
 from abc import ABC, abstractmethod
-from typing import List, Union, Dict, Callable, Tuple
-from dria_agent.pythonic.engine import ExecutionResults
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import replace
+from typing import List, Union, Dict, Callable, Tuple, Optional, AsyncIterator
+
+from rich.console import Console
+from rich.panel import Panel
+
+from dria_agent.agent.batching import MicroBatcher
+from dria_agent.agent.cache import EmbeddingCache
+from dria_agent.agent.metrics import (
+    METRICS,
+    TOKENS_PER_SECOND_BUCKETS,
+    MetricsRegistry,
+    RunMetrics,
+    batch_item,
+    batch_runs,
+    collect_batch,
+    collect_run,
+    current_run,
+)
+from dria_agent.agent.settings.generation import (
+    CODE_FENCE_STOP,
+    GenerationConfig,
+    apply_stop,
+    should_stop,
+)
+from dria_agent.agent.settings.prompt import PROMPT_LAYOUTS, render_system_prompt
 from dria_agent.agent.vdb import ToolDB
+from dria_agent.pythonic.engine import (
+    ExecutionResults,
+    execute_tool_call,
+    async_execute_tool_call,
+)
+from dria_agent.pythonic.schemas import ExecutionLimits, StreamEvent
+from dria_agent.pythonic.util import code_block_end
+
+# Pipeline stages reported to the metrics hook, in execution order.
+STAGES = ("query", "retrieval", "prompt", "generation", "execution")
+
+# Whether the current context generates tool calls or free-form instruct answers.
+_INSTRUCT_MODE: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "dria_agent_instruct_mode", default=False
+)
 
 
 class ToolCallingAgentBase(ABC):
+    """
+    Shared retrieval + prompt + execution pipeline.
+
+    A query goes through the stages query extraction, tool retrieval, prompt rendering,
+    generation and execution. Backends only implement generation (and, if they need a
+    raw prompt instead of chat messages, prompt formatting).
+
+    Stage durations, token usage, tool calls and errors are recorded in a metrics
+    registry and on a per-run record attached to the returned ExecutionResults.
+    """
+
+    # Label of the backend in recorded metrics.
+    backend = "base"
+    # Threads running _generate_content for async callers, local models generate one
+    # prompt at a time.
+    generation_workers = 1
+    # Whether _generate_batch generates several prompts in one call (e.g. a padded batch)
+    # instead of one by one.
+    batched_generation = False
+    # Generation parameters of the backend, overridden by the generation_config argument.
+    default_generation = GenerationConfig(stop=[CODE_FENCE_STOP])
 
-    def __init__(self, embedding, tools: List, model: str):
+    def __init__(
+        self,
+        embedding,
+        tools: List,
+        model: str,
+        index: str = "flat",
+        cache_dir: Optional[str] = None,
+        metrics_hook: Optional[Callable[[str, float], None]] = None,
+        metrics: Optional[MetricsRegistry] = None,
+        max_batch_size: int = 1,
+        max_batch_wait_ms: float = 5.0,
+        generation_config: Optional[GenerationConfig] = None,
+        prompt_layout: str = "inline",
+        execution_limits: Optional[ExecutionLimits] = None,
+        parallel_tool_calls: bool = True,
+    ):
         """
         :param tools: A list of tool objects. Each tool should have a .name attribute and be callable.
         :param model: The name of the model to use for chat inference.
+        :param index: The ToolDB index used for tool retrieval, "flat" or "hnsw".
+        :param cache_dir: If set, tool embeddings are cached on disk under this directory.
+        :param metrics_hook: Optional callable receiving (stage, seconds) for each pipeline stage.
+        :param metrics: Metrics registry to record into, defaults to the process-wide one.
+        :param max_batch_size: If greater than 1, concurrent async generations are micro-batched
+            into batches of up to this many prompts.
+        :param max_batch_wait_ms: Maximum time a prompt waits for others to fill its batch.
+        :param generation_config: Max tokens, stop sequences and sampling parameters, unset
+            fields keep the backend's defaults.
+        :param prompt_layout: System prompt layout, "inline" lists the tools between the
+            instructions, "static_first" lists them after all instructions so the prompt
+            caches of inference servers can reuse the instructions across requests.
+        :param execution_limits: Default timeouts and resource limits of the execution of
+            completions, overridden by the limits argument of the run methods.
+        :param parallel_tool_calls: Whether independent tool calls of a completion run
+            concurrently by default, overridden by the parallel argument of the run
+            methods. Disable it for tools with side effects that must run in order.
         """
-        # Build a mapping from tool names to tool objects.
-        self.tools = {tool.name: tool for tool in tools}
-        self.db = ToolDB(embedding=embedding)
-        schemas = [str(tool) for name, tool in self.tools.items()]
-        self.db.add(schemas)
+        if prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(
+                f"Unknown prompt layout {prompt_layout!r}, expected one of {list(PROMPT_LAYOUTS)}"
+            )
+        self.prompt_layout = prompt_layout
+        self.execution_limits = execution_limits
+        self.parallel_tool_calls = parallel_tool_calls
+        self.metrics_hook = metrics_hook
+        self.metrics = metrics if metrics is not None else METRICS
+        self._generation = self.default_generation.merge(generation_config)
+        # Instruct answers use no tools, they must not stop at the first code block.
+        self._instruct_generation = replace(
+            self._generation,
+            stop=[s for s in self._generation.stop or [] if s != CODE_FENCE_STOP],
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.generation_workers,
+            thread_name_prefix=f"dria-{self.backend}",
+        )
+        self._batcher = (
+            MicroBatcher(
+                self._async_generate_batch,
+                max_batch_size=max_batch_size,
+                max_wait_ms=max_batch_wait_ms,
+                labels={"backend": self.backend},
+            )
+            if max_batch_size > 1
+            else None
+        )
+        cache = (
+            EmbeddingCache(embedding.model_name, embedding.dim, cache_dir)
+            if cache_dir
+            else None
+        )
+        self.db = ToolDB(embedding=embedding, index=index, cache=cache)
+        # Tool registry: name -> tool, the schema it was embedded with, and its ToolDB row,
+        # plus a row -> tool table aligned with the ToolDB rows (None for removed rows).
+        self.tools: Dict[str, Callable] = {}
+        self._schemas: Dict[str, str] = {}
+        self._rows: Dict[str, int] = {}
+        self._row_tools: List[Optional[Callable]] = []
+        self.set_tools(tools)
         self.model = model
 
-    @abstractmethod
+    @property
+    def generation(self) -> GenerationConfig:
+        """Generation parameters of the current mode, see _instruct_mode."""
+        if _INSTRUCT_MODE.get():
+            return self._instruct_generation
+        return self._generation
+
+    @contextmanager
+    def _instruct_mode(self):
+        """Generate free-form answers, without the code fence stop, within the block."""
+        token = _INSTRUCT_MODE.set(True)
+        try:
+            yield
+        finally:
+            _INSTRUCT_MODE.reset(token)
+
+    @contextmanager
+    def _stage(self, name: str):
+        """Time a pipeline stage and report it to the metrics"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            run = current_run()
+            # A stage shared by a batch, such as batched retrieval, counts toward
+            # each of its runs.
+            for run in [run] if run is not None else batch_runs():
+                run.stages[name] = run.stages.get(name, 0.0) + elapsed
+            self.metrics.observe(
+                "dria_agent_stage_seconds", elapsed, backend=self.backend, stage=name
+            )
+            if self.metrics_hook is not None:
+                self.metrics_hook(name, elapsed)
+
+    @contextmanager
+    def _track_run(self, run: Optional[RunMetrics] = None):
+        """Collect the metrics of one run in the current context"""
+        with collect_run(self.backend, run) as run:
+            try:
+                yield run
+            except Exception:
+                self.metrics.inc("dria_agent_errors_total", backend=self.backend)
+                raise
+
+    def _record_generation(self, run: RunMetrics) -> None:
+        """Update token counters and throughput from a finished run"""
+        labels = {"backend": self.backend}
+        generation = run.stages.get("generation")
+        if run.completion_tokens and generation:
+            run.tokens_per_second = run.completion_tokens / generation
+            self.metrics.observe(
+                "dria_agent_tokens_per_second",
+                run.tokens_per_second,
+                buckets=TOKENS_PER_SECOND_BUCKETS,
+                **labels,
+            )
+        self.metrics.inc("dria_agent_prompt_tokens_total", run.prompt_tokens, **labels)
+        self.metrics.inc(
+            "dria_agent_completion_tokens_total", run.completion_tokens, **labels
+        )
+
+    def _record_run(
+        self, run: RunMetrics, execution: ExecutionResults
+    ) -> ExecutionResults:
+        """Update the registry from a finished run and attach it to the results"""
+        labels = {"backend": self.backend}
+        self._record_generation(run)
+        for name, value in execution.results.items():
+            run.tool_calls[name] = len(value) if isinstance(value, list) else 1
+            self.metrics.inc(
+                "dria_agent_tool_calls_total", run.tool_calls[name], tool=name, **labels
+            )
+        run.errors = len(execution.errors)
+
+        self.metrics.inc("dria_agent_runs_total", **labels)
+        if run.errors:
+            self.metrics.inc("dria_agent_errors_total", run.errors, **labels)
+        execution.metrics = run.to_dict()
+        return execution
+
+    @staticmethod
+    def _to_messages(query: Union[str, List[Dict]]) -> List[Dict]:
+        return (
+            [{"role": "user", "content": query}]
+            if isinstance(query, str)
+            else query.copy()
+        )
+
+    @staticmethod
+    def _search_query(messages: List[Dict]) -> str:
+        """Get the tool search query from user messages, skipping feedback turns"""
+        user_msgs = [m["content"] for m in messages if m["role"] == "user"]
+        return (
+            user_msgs[-2]
+            if "Please re-think your response and fix errors" in user_msgs[-1]
+            else user_msgs[-1]
+        )
+
+    def _format_prompt(self, messages: List[Dict]) -> Union[str, List[Dict]]:
+        """Turn chat messages into the backend's generation input"""
+        return messages
+
+    def _check_query(self, query: Union[str, List[Dict]], num_tools: int) -> List[Dict]:
+        with self._stage("query"):
+            if num_tools <= 0 or num_tools > 5:
+                raise RuntimeError(
+                    "Number of tools cannot be less than 0 or greater than 3 for optimal performance"
+                )
+            return self._to_messages(query)
+
+    def _build_prompt(
+        self, messages: List[Dict], tools: List
+    ) -> Tuple[Union[str, List[Dict]], List[Callable]]:
+        with self._stage("prompt"):
+            # List tools by name rather than by retrieval rank, so the same tool set
+            # always renders the same system prompt and prompt caches can reuse it.
+            schemas = [tool.schema for tool in sorted(tools, key=lambda t: t.name)]
+            messages.insert(
+                0,
+                {
+                    "role": "system",
+                    "content": render_system_prompt(schemas, self.prompt_layout),
+                },
+            )
+            prompt = self._format_prompt(messages)
+
+        return prompt, [t.func for t in tools]
+
     def _prepare_messages(
         self, query: Union[str, List[Dict]], num_tools: int
-    ) -> Tuple[str, List[Callable]]:
+    ) -> Tuple[Union[str, List[Dict]], List[Callable]]:
         """Prepare messages and tools for execution"""
-        pass
+        messages = self._check_query(query, num_tools)
+        with self._stage("retrieval"):
+            rows = self.db.nearest(self._search_query(messages), k=num_tools)
+            tools = self._tools_for_rows(rows.tolist())
+        return self._build_prompt(messages, tools)
+
+    async def _async_prepare_messages(
+        self, query: Union[str, List[Dict]], num_tools: int
+    ) -> Tuple[Union[str, List[Dict]], List[Callable]]:
+        """Prepare messages and tools, embedding the query off the event loop"""
+        messages = self._check_query(query, num_tools)
+        with self._stage("retrieval"):
+            rows = await asyncio.to_thread(
+                self.db.nearest, self._search_query(messages), num_tools
+            )
+            tools = self._tools_for_rows(rows.tolist())
+        return self._build_prompt(messages, tools)
+
+    def _prepare_messages_batch(
+        self, queries: List[Union[str, List[Dict]]], num_tools: int
+    ) -> List[Tuple[Union[str, List[Dict]], List[Callable]]]:
+        """
+        Prepare messages for several queries with a single batched tool search. Under
+        collect_batch, the stages of each query are attributed to its run.
+        """
+        messages = []
+        for i, query in enumerate(queries):
+            with batch_item(i):
+                messages.append(self._check_query(query, num_tools))
+        with self._stage("retrieval"):
+            rows = self.db.nearest_batch(
+                [self._search_query(m) for m in messages], k=num_tools
+            )
+            tools = [self._tools_for_rows(r.tolist()) for r in rows]
+        prepared = []
+        for i, (m, t) in enumerate(zip(messages, tools)):
+            with batch_item(i):
+                prepared.append(self._build_prompt(m, t))
+        return prepared
 
     @abstractmethod
     def _generate_content(self, messages: Union[List[Dict], str]) -> str:
         """Generate content from messages"""
         pass
 
-    @abstractmethod
+    async def _async_generate_content(self, messages: Union[List[Dict], str]) -> str:
+        """
+        Generate content without blocking the event loop. Backends with an async
+        client override this, the default runs _generate_content on the executor.
+        """
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, ctx.run, self._generate_content, messages
+        )
+
+    async def _async_stream_content(
+        self, messages: Union[List[Dict], str]
+    ) -> AsyncIterator[str]:
+        """
+        Yield the completion in chunks as they are generated. Closing the iterator must
+        stop generation. Backends without streaming yield the whole completion at once.
+        """
+        yield await self._async_generate_content(messages)
+
+    def _generate_batch(self, prompts: List[Union[List[Dict], str]]) -> List[str]:
+        """Generate content for several prompts, backends setting batched_generation override this"""
+        contents = []
+        for i, prompt in enumerate(prompts):
+            with batch_item(i):
+                contents.append(self._generate_content(prompt))
+        return contents
+
+    async def _async_generate_item(
+        self, index: int, prompt: Union[List[Dict], str]
+    ) -> str:
+        with batch_item(index):
+            return await self._async_generate_content(prompt)
+
+    async def _async_generate_batch(
+        self, prompts: List[Union[List[Dict], str]]
+    ) -> List[str]:
+        """
+        Generate a micro-batch of prompts: one _generate_batch call on the executor for
+        backends with batched generation, otherwise concurrent single generations.
+        """
+        if self.batched_generation:
+            loop = asyncio.get_running_loop()
+            ctx = contextvars.copy_context()
+            return await loop.run_in_executor(
+                self._executor, ctx.run, self._generate_batch, prompts
+            )
+        return await asyncio.gather(
+            *(self._async_generate_item(i, p) for i, p in enumerate(prompts))
+        )
+
     def _display_completion(self, content: str) -> None:
         """Display completion in console"""
-        pass
+        console = Console()
+        console.rule("[bold blue]Agent Response")
+        panel = Panel(content, title="Agent", subtitle="End of Response", expand=False)
+        console.print(panel)
+        console.rule()
+
+    def _generate(self, prompt: Union[str, List[Dict]], show_completion: bool) -> str:
+        with self._stage("generation"):
+            content = apply_stop(self._generate_content(prompt), self.generation.stop)
+
+        if show_completion:
+            self._display_completion(content)
+        return content
+
+    async def _async_generate(
+        self, prompt: Union[str, List[Dict]], show_completion: bool
+    ) -> str:
+        with self._stage("generation"):
+            if self._batcher is not None:
+                content = await self._batcher.submit(prompt)
+            else:
+                content = await self._async_generate_content(prompt)
+            content = apply_stop(content, self.generation.stop)
+
+        if show_completion:
+            self._display_completion(content)
+        return content
 
-    @abstractmethod
     def run(
         self,
         query: Union[str, List[Dict]],
-        dry_run=False,
-        show_completion=True,
-        num_tools=3,
+        dry_run: bool = False,
+        show_completion: bool = True,
+        num_tools: int = 2,
+        limits: Optional[ExecutionLimits] = None,
+        parallel: Optional[bool] = None,
     ) -> ExecutionResults:
         """
         Performs an inference given a query string or a list of message dicts.
@@ -50,17 +427,26 @@ class ToolCallingAgentBase(ABC):
         :param dry_run: If True, returns the final response as a string instead of executing the tool.
         :param show_completion: If True, displays the completion in the console.
         :param num_tools: The number of tools to use for the inference.
+        :param limits: Timeouts and resource limits of the execution, defaults to the
+            agent's execution_limits.
+        :param parallel: Whether independent tool calls run concurrently, defaults to
+            the agent's parallel_tool_calls.
         :return: The final response from the model.
         """
-        pass
+        with self._track_run() as run:
+            prompt, tools = self._prepare_messages(query, num_tools)
+            content = self._generate(prompt, show_completion)
+            execution = self._execute(content, tools, dry_run, limits, parallel)
+        return self._record_run(run, execution)
 
-    @abstractmethod
     async def async_run(
         self,
         query: Union[str, List[Dict]],
-        dry_run=False,
-        show_completion=True,
-        num_tools=3,
+        dry_run: bool = False,
+        show_completion: bool = True,
+        num_tools: int = 2,
+        limits: Optional[ExecutionLimits] = None,
+        parallel: Optional[bool] = None,
     ) -> ExecutionResults:
         """
         Asynchronously performs an inference given a query string or a list of message dicts.
@@ -69,12 +455,181 @@ class ToolCallingAgentBase(ABC):
         :param dry_run: If True, returns the final response as a string instead of executing the tool.
         :param show_completion: If True, displays the completion in the console.
         :param num_tools: The number of tools to use for the inference.
+        :param limits: Timeouts and resource limits of the execution, defaults to the
+            agent's execution_limits.
+        :param parallel: Whether independent tool calls run concurrently, defaults to
+            the agent's parallel_tool_calls.
         :return: The final response from the model.
         """
-        pass
+        with self._track_run() as run:
+            prompt, tools = await self._async_prepare_messages(query, num_tools)
+            content = await self._async_generate(prompt, show_completion)
+            execution = await self._async_execute(
+                content, tools, dry_run, limits, parallel
+            )
+        return self._record_run(run, execution)
 
-    @abstractmethod
-    def instruct(self, query: Union[str, List[Dict]], show_completion=False):
+    async def stream_run(
+        self,
+        query: Union[str, List[Dict]],
+        dry_run: bool = False,
+        num_tools: int = 2,
+        limits: Optional[ExecutionLimits] = None,
+        parallel: Optional[bool] = None,
+    ) -> AsyncIterator[StreamEvent]:
+        """
+        Performs an inference while streaming the completion. Generation stops as soon as
+        the python code block is closed and the code is executed right away.
+
+        :param query: A string (query) or a list of message dicts for a conversation.
+        :param dry_run: If True, stops after the code_ready event without executing the tool.
+        :param num_tools: The number of tools to use for the inference.
+        :param limits: Timeouts and resource limits of the execution, defaults to the
+            agent's execution_limits.
+        :param parallel: Whether independent tool calls run concurrently, defaults to
+            the agent's parallel_tool_calls.
+        :return: An async iterator of token, code_ready, tool_result and final events.
+        """
+        # The pipeline runs in its own task so the run metrics context does not leak
+        # into the consumer, and so it can be cancelled if the consumer stops early.
+        queue: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(
+            self._stream_pipeline(
+                query, dry_run, num_tools, queue.put_nowait, limits, parallel
+            )
+        )
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def _stream_pipeline(
+        self,
+        query: Union[str, List[Dict]],
+        dry_run: bool,
+        num_tools: int,
+        emit: Callable[[Optional[StreamEvent]], None],
+        limits: Optional[ExecutionLimits] = None,
+        parallel: Optional[bool] = None,
+    ) -> None:
+        try:
+            with self._track_run() as run:
+                prompt, tools = await self._async_prepare_messages(query, num_tools)
+
+                content = ""
+                with self._stage("generation"):
+                    stream = self._async_stream_content(prompt)
+                    try:
+                        async for chunk in stream:
+                            content += chunk
+                            emit(StreamEvent(type="token", data=chunk))
+                            end = code_block_end(content)
+                            if end is not None or should_stop(
+                                content, self.generation.stop
+                            ):
+                                content = content[:end]
+                                break
+                    finally:
+                        await stream.aclose()
+                content = apply_stop(content, self.generation.stop)
+                emit(StreamEvent(type="code_ready", data=content))
+
+                execution = await self._async_execute(
+                    content, tools, dry_run, limits, parallel
+                )
+            for name, value in execution.results.items():
+                result = execution.data.get(value) if isinstance(value, str) else value
+                emit(
+                    StreamEvent(
+                        type="tool_result", data={"tool": name, "result": result}
+                    )
+                )
+            emit(StreamEvent(type="final", data=self._record_run(run, execution)))
+        finally:
+            emit(None)
+
+    def run_batch(
+        self,
+        queries: List[Union[str, List[Dict]]],
+        dry_run: bool = False,
+        show_completion: bool = True,
+        num_tools: int = 2,
+        limits: Optional[ExecutionLimits] = None,
+        parallel: Optional[bool] = None,
+    ) -> List[ExecutionResults]:
+        """
+        Performs inference for several queries, retrieving tools for all of them at once.
+
+        :param queries: A list of query strings or message dict lists.
+        :param dry_run: If True, returns the final responses without executing the tools.
+        :param show_completion: If True, displays the completions in the console.
+        :param num_tools: The number of tools to use for each inference.
+        :param limits: Timeouts and resource limits of each execution, defaults to the
+            agent's execution_limits.
+        :param parallel: Whether independent tool calls run concurrently, defaults to
+            the agent's parallel_tool_calls.
+        :return: The execution results, in the order of the queries.
+        """
+        runs = [RunMetrics(backend=self.backend) for _ in queries]
+        with collect_batch(runs):
+            prepared = self._prepare_messages_batch(queries, num_tools)
+        executions = []
+        for run, (prompt, tools) in zip(runs, prepared):
+            with self._track_run(run):
+                content = self._generate(prompt, show_completion)
+                execution = self._execute(content, tools, dry_run, limits, parallel)
+            executions.append(self._record_run(run, execution))
+        return executions
+
+    def _execute(
+        self,
+        content: str,
+        tools: List[Callable],
+        dry_run: bool,
+        limits: Optional[ExecutionLimits] = None,
+        parallel: Optional[bool] = None,
+    ) -> ExecutionResults:
+        if dry_run:
+            return ExecutionResults(
+                content=content, results={}, data={}, errors=[], is_dry=True
+            )
+
+        with self._stage("execution"):
+            return execute_tool_call(
+                completion=content,
+                functions=tools,
+                limits=limits or self.execution_limits,
+                parallel=self.parallel_tool_calls if parallel is None else parallel,
+            )
+
+    async def _async_execute(
+        self,
+        content: str,
+        tools: List[Callable],
+        dry_run: bool,
+        limits: Optional[ExecutionLimits] = None,
+        parallel: Optional[bool] = None,
+    ) -> ExecutionResults:
+        if dry_run:
+            return ExecutionResults(
+                content=content, results={}, data={}, errors=[], is_dry=True
+            )
+
+        with self._stage("execution"):
+            return await async_execute_tool_call(
+                completion=content,
+                functions=tools,
+                limits=limits or self.execution_limits,
+                parallel=self.parallel_tool_calls if parallel is None else parallel,
+            )
+
+    def instruct(self, query: Union[str, List[Dict]], show_completion: bool = False):
         """
         Instruct the agent to respond to a query without executing any tools.
 
@@ -82,12 +637,91 @@ class ToolCallingAgentBase(ABC):
         :param show_completion: If True, displays the completion in the console.
         :return: The final response from the model.
         """
-        pass
+        with self._track_run() as run, self._instruct_mode():
+            with self._stage("prompt"):
+                prompt = self._format_prompt(self._to_messages(query))
+
+            with self._stage("generation"):
+                content = apply_stop(
+                    self._generate_content(prompt), self.generation.stop
+                )
+        self._record_generation(run)
+
+        if show_completion:
+            self._display_completion("Instruct Mode: \n\n" + content)
+
+        return content
+
+    async def async_instruct(
+        self, query: Union[str, List[Dict]], show_completion: bool = False
+    ):
+        """
+        Asynchronously instruct the agent to respond to a query without executing any tools.
+
+        :param query: A string (query) or a list of message dicts for a conversation.
+        :param show_completion: If True, displays the completion in the console.
+        :return: The final response from the model.
+        """
+        with self._track_run() as run, self._instruct_mode():
+            with self._stage("prompt"):
+                prompt = self._format_prompt(self._to_messages(query))
+
+            with self._stage("generation"):
+                content = apply_stop(
+                    await self._async_generate_content(prompt), self.generation.stop
+                )
+        self._record_generation(run)
+
+        if show_completion:
+            self._display_completion("Instruct Mode: \n\n" + content)
+
+        return content
+
+    def close(self) -> None:
+        """Stop the generation workers and release the shared models of the agent."""
+        self._executor.shutdown(wait=False)
+        self.db.embedding.close()
 
     def set_tools(self, tools: List):
         """
         Set the tools for the agent.
+
+        Only tools that are new or whose schema changed are embedded, removed and
+        changed tools are tombstoned in the ToolDB.
         """
         self.tools = {tool.name: tool for tool in tools}
-        schemas = [str(tool) for name, tool in self.tools.items()]
-        self.db.add(schemas)
+        schemas = {name: str(tool) for name, tool in self.tools.items()}
+
+        stale = [
+            name for name in self._schemas if schemas.get(name) != self._schemas[name]
+        ]
+        stale_rows = [self._rows.pop(name) for name in stale if name in self._rows]
+        for name in stale:
+            del self._schemas[name]
+        for row in stale_rows:
+            self._row_tools[row] = None
+        if stale_rows:
+            self.db.remove(stale_rows)
+
+        pending = [name for name in schemas if name not in self._schemas]
+        rows = self.db.add([schemas[name] for name in pending])
+        self._row_tools.extend([None] * (self.db.count - len(self._row_tools)))
+        for name, row in zip(pending, rows.tolist()):
+            self._schemas[name] = schemas[name]
+            if row >= 0:
+                self._rows[name] = row
+
+        # Reclaim tombstoned rows once they outnumber the live ones.
+        if self.db.count > 2 * len(self._rows):
+            mapping = self.db.compact()
+            self._rows = {name: int(mapping[row]) for name, row in self._rows.items()}
+            self._row_tools = [None] * self.db.count
+
+        # Unchanged tools may still be new objects, e.g. after an MCP reconnect.
+        for name, row in self._rows.items():
+            self._row_tools[row] = self.tools[name]
+
+    def _tools_for_rows(self, rows) -> List:
+        """Map ToolDB rows returned by nearest() to tool objects."""
+        table = self._row_tools
+        return [table[row] for row in rows]
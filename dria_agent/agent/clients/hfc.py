@@ -1,159 +1,277 @@
-from typing import List, Union, Dict, Callable, Tuple
+from typing import List, Dict, Optional
+import copy
 import logging
 import importlib.util
 
-from dria_agent.agent.settings.prompt import system_prompt
+from dria_agent.agent.cache import LRUCache
+from dria_agent.agent.metrics import batch_item, record_tokens
+from dria_agent.agent.settings.generation import (
+    CODE_FENCE_STOP,
+    GenerationConfig,
+    should_stop,
+)
+from dria_agent.agent.registry import MODELS
 from .base import ToolCallingAgentBase
-from dria_agent.pythonic.schemas import ExecutionResults
-from dria_agent.pythonic.engine import execute_tool_call, async_execute_tool_call
-from rich.console import Console
-from rich.panel import Panel
+from .kv_cache import PrefixKVCache, common_prefix_length, prefix_boundaries
 
 logger = logging.getLogger(__name__)
 
+DTYPES = ("float32", "bfloat16", "float16")
+QUANTIZATIONS = ("int8",)
+
+
+class CodeFenceStoppingCriteria:
+    """
+    Stopping criteria ending each sequence of a batch once its completion reached a
+    stop sequence or closed its python code block.
+    """
+
+    def __init__(self, tokenizer, prompt_len: int, stop: List[str]):
+        import torch
+
+        self.torch = torch
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.stop = stop
+        # Only decode a completion when its last token can end a stop sequence.
+        self.last_chars = {"`"} | {sequence[-1] for sequence in stop if sequence}
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = []
+        for row in input_ids:
+            last = self.tokenizer.decode(row[-1:])
+            done.append(
+                any(c in last for c in self.last_chars)
+                and should_stop(
+                    self.tokenizer.decode(
+                        row[self.prompt_len :], skip_special_tokens=True
+                    ),
+                    self.stop,
+                )
+            )
+        return self.torch.tensor(done, dtype=self.torch.bool, device=input_ids.device)
+
 
 class HuggingfaceToolCallingAgent(ToolCallingAgentBase):
+    backend = "huggingface"
+    batched_generation = True
+    default_generation = GenerationConfig(
+        max_tokens=1024, stop=[CODE_FENCE_STOP], temperature=0.5, min_p=0.95
+    )
+
     def __init__(
         self,
         embedding,
         tools: List,
         model: str = "driaforall/Tiny-Agent-a-3b",
         tokenizer: str = "driaforall/Tiny-Agent-a-3b",
+        prefix_cache_size: int = 4,
+        token_cache_size: int = 32,
+        dtype: Optional[str] = None,
+        quantize: Optional[str] = None,
+        low_cpu_mem_usage: Optional[bool] = None,
+        num_threads: Optional[int] = None,
+        **kwargs,
     ):
-        super().__init__(embedding, tools, model)
+        """
+        :param tokenizer: The tokenizer to use, usually the model's.
+        :param prefix_cache_size: Number of tool-set prompt prefixes whose KV cache is kept
+            to skip their prefill, 0 disables prefix caching.
+        :param token_cache_size: Number of formatted system prompts whose token ids are kept
+            to skip their tokenization.
+        :param dtype: Weight dtype, "float32", "bfloat16" or "float16". Defaults to
+            float32, bfloat16 halves the memory of the model.
+        :param quantize: "int8" quantizes the linear layers dynamically with
+            torch.ao.quantization for CPU inference, the model is loaded in float32.
+        :param low_cpu_mem_usage: Load the weights without first allocating a randomly
+            initialized model, roughly halving peak memory while loading. Requires
+            accelerate, defaults to whether it is installed.
+        :param num_threads: Number of threads torch uses for CPU inference. It is a
+            process-wide setting.
+        """
+        if dtype is not None and dtype not in DTYPES:
+            raise ValueError(f"Unknown dtype {dtype!r}, expected one of {DTYPES}")
+        if quantize is not None and quantize not in QUANTIZATIONS:
+            raise ValueError(
+                f"Unknown quantization {quantize!r}, expected one of {QUANTIZATIONS}"
+            )
+        if quantize is not None and dtype not in (None, "float32"):
+            raise ValueError("Dynamic int8 quantization requires float32 weights")
+        accelerate = importlib.util.find_spec("accelerate") is not None
+        if low_cpu_mem_usage is None:
+            low_cpu_mem_usage = accelerate
+        elif low_cpu_mem_usage and not accelerate:
+            raise ImportError(
+                "low_cpu_mem_usage requires 'accelerate'. Install it with: pip install accelerate"
+            )
+        super().__init__(embedding, tools, model, **kwargs)
         if importlib.util.find_spec("transformers") is None:
             raise ImportError(
                 "Optional dependency 'transformers' is not installed. Install it with: pip install 'dria-agent[huggingface]'"
             )
         else:
-            from transformers import AutoModelForCausalLM, AutoTokenizer
-        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer)
-        self.model = AutoModelForCausalLM.from_pretrained(model)
-        self.temperature = 0.5
-        self.min_p = 0.95
-
-    def _prepare_messages(
-        self, query: Union[str, List[Dict]], num_tools: int
-    ) -> Tuple[str, List[Callable]]:
-        """Prepare messages and tools for execution"""
-        if num_tools <= 0 or num_tools > 5:
-            raise RuntimeError(
-                "Number of tools cannot be less than 0 or greater than 3 for optimal performance"
+            import torch
+            from transformers import (
+                AutoModelForCausalLM,
+                AutoTokenizer,
+                DynamicCache,
+                StoppingCriteriaList,
             )
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer)
+        # Batched prompts are left padded so generation continues right after each prompt.
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        # A chat template adds the special tokens of the model itself.
+        self.chat_template = self.tokenizer.chat_template is not None
+        self._special_tokens = tuple(self.tokenizer.all_special_tokens)
+        self.token_cache = LRUCache(token_cache_size)
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self.dtype = dtype or "float32"
+        self.quantize = quantize
 
-        messages = (
-            [{"role": "user", "content": query}]
-            if isinstance(query, str)
-            else query.copy()
-        )
-
-        # Get search query from user messages
-        user_msgs = [m["content"] for m in messages if m["role"] == "user"]
-        search_query = (
-            user_msgs[-2]
-            if "Please re-think your response and fix errors" in user_msgs[-1]
-            else user_msgs[-1]
-        )
-
-        # Get relevant tools
-        inds = self.db.nearest(search_query, k=num_tools)
-        tools = [list(self.tools.values())[ind] for ind in inds]
-        tool_info = "\n".join(str(tool) for tool in tools)
-
-        # Add system message
-        messages.insert(
-            0,
-            {
-                "role": "system",
-                "content": system_prompt.replace("{{functions_schema}}", tool_info),
-            },
-        )
+        def load():
+            loaded = AutoModelForCausalLM.from_pretrained(
+                model,
+                torch_dtype=getattr(torch, self.dtype),
+                low_cpu_mem_usage=low_cpu_mem_usage,
+            )
+            loaded.eval()
+            if quantize == "int8":
+                loaded = torch.ao.quantization.quantize_dynamic(
+                    loaded, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            return loaded
 
-        # Generate prompt
-        prompt = (
-            "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages) + "\n"
+        # Agents loading the same model in the same dtype share it.
+        self._model_key = (self.backend, model, quantize or self.dtype)
+        self.model = MODELS.acquire(self.backend, model, load, dtype=self._model_key[2])
+        self.torch = torch
+        self.StoppingCriteriaList = StoppingCriteriaList
+        self.DynamicCache = DynamicCache
+        self.prefix_cache = (
+            PrefixKVCache(prefix_cache_size) if prefix_cache_size > 0 else None
         )
 
-        return prompt, [t.func for t in tools]
+    def close(self) -> None:
+        super().close()
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
+        if self.model is not None:
+            self.model = None
+            MODELS.release(*self._model_key)
 
-    def _generate_content(self, prompt: str) -> str:
-        """Generate content from prompt"""
-        inputs = self.tokenizer(prompt, return_tensors="pt")
-        outputs = self.model.generate(
-            **inputs,
-            max_new_tokens=1024,
-            do_sample=True,
-            temperature=self.temperature,
-            min_p=self.min_p,
-        )
-        return self.tokenizer.decode(outputs[0], skip_special_tokens=True)[
-            len(prompt) :
-        ].strip()
-
-    def _display_completion(self, content: str) -> None:
-        """Display completion in console"""
-        console = Console()
-        console.rule("[bold blue]Agent Response")
-        panel = Panel(content, title="Agent", subtitle="End of Response", expand=False)
-        console.print(panel)
-        console.rule()
-
-    def run(
-        self,
-        query: Union[str, List[Dict]],
-        dry_run: bool = False,
-        show_completion: bool = True,
-        num_tools: int = 2,
-    ) -> ExecutionResults:
-        """Run agent synchronously"""
-        prompt, tools = self._prepare_messages(query, num_tools)
-        content = self._generate_content(prompt)
-
-        if show_completion:
-            self._display_completion(content)
-
-        if dry_run:
-            return ExecutionResults(
-                content=content, results={}, data={}, errors=[], is_dry=True
+    def _generate_kwargs(self, prompt_len: int) -> dict:
+        """Arguments of model.generate for the generation config"""
+        kwargs = {
+            "max_new_tokens": self.generation.max_tokens,
+            "pad_token_id": self.tokenizer.pad_token_id,
+            "stopping_criteria": self.StoppingCriteriaList(
+                [
+                    CodeFenceStoppingCriteria(
+                        self.tokenizer, prompt_len, self.generation.stop or []
+                    )
+                ]
+            ),
+        }
+        if self.generation.temperature:
+            kwargs.update(
+                do_sample=True,
+                temperature=self.generation.temperature,
+                min_p=self.generation.min_p,
             )
+        else:
+            kwargs["do_sample"] = False
+        return kwargs
 
-        return execute_tool_call(completion=content, functions=tools)
-
-    async def async_run(
-        self,
-        query: Union[str, List[Dict]],
-        dry_run: bool = False,
-        show_completion: bool = True,
-        num_tools: int = 2,
-    ) -> ExecutionResults:
-        """Run agent asynchronously"""
-        prompt, tools = self._prepare_messages(query, num_tools)
-        content = self._generate_content(prompt)
-
-        if show_completion:
-            self._display_completion(content)
-
-        if dry_run:
-            return ExecutionResults(
-                content=content, results={}, data={}, errors=[], is_dry=True
+    def _format_prompt(self, messages: List[Dict]) -> str:
+        """Generate prompt"""
+        if self.chat_template:
+            return self.tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
             )
+        return "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages) + "\n"
 
-        return await async_execute_tool_call(completion=content, functions=tools)
+    def _tokenize(self, text: str) -> List[int]:
+        return self.tokenizer(text, add_special_tokens=not self.chat_template)[
+            "input_ids"
+        ]
 
-    def instruct(self, query: Union[str, List[Dict]], show_completion: bool = False):
+    def _cached_tokenize(self, text: str) -> List[int]:
+        ids = self.token_cache.get(text)
+        if ids is None:
+            ids = self._tokenize(text)
+            self.token_cache.put(text, ids)
+        return ids
 
-        messages = (
-            [{"role": "user", "content": query}]
-            if isinstance(query, str)
-            else query.copy()
-        )
+    def _encode(self, prompt: str) -> List[int]:
+        """
+        Token ids of a prompt, reusing the cached ids of its system prompt. The system
+        prompt is only tokenized apart when a special token follows it, no token can
+        span the split then.
+        """
+        boundaries = prefix_boundaries(prompt)
+        if boundaries:
+            head, tail = prompt[: boundaries[-1]], prompt[boundaries[-1] :]
+            if tail.startswith(self._special_tokens):
+                return self._cached_tokenize(head) + self._tokenize(tail)
+        return self._tokenize(prompt)
 
-        prompt = (
-            "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages) + "\n"
-        )
+    def _generate_content(self, prompt: str) -> str:
+        """Generate content from prompt"""
+        ids = self._encode(prompt)
+        inputs = {
+            "input_ids": self.torch.tensor([ids]),
+            "attention_mask": self.torch.ones(1, len(ids), dtype=self.torch.long),
+        }
+        input_len = len(ids)
+        kwargs = self._generate_kwargs(input_len)
+        if self.prefix_cache is not None:
+            cached_len, past = self.prefix_cache.lookup(ids)
+            # generate() only prefills the tokens missing from the cache.
+            kwargs["past_key_values"] = (
+                past if past is not None else self.DynamicCache()
+            )
+        outputs = self.model.generate(**inputs, **kwargs)
+        if self.prefix_cache is not None:
+            self._store_prefixes(prompt, ids, kwargs["past_key_values"], cached_len)
+        record_tokens(input_len, outputs.shape[1] - input_len)
+        return self.tokenizer.decode(
+            outputs[0][input_len:], skip_special_tokens=True
+        ).strip()
 
-        content = self._generate_content(prompt)
-        if show_completion:
-            self._display_completion("Instruct Mode: \n\n" + content)
+    def _store_prefixes(self, prompt: str, ids: List[int], past, cached_len: int):
+        """Keep the KV cache of the shared prefixes of a prompt that are not cached yet"""
+        boundaries = prefix_boundaries(prompt)
+        # Longest first, cropping the cache is destructive.
+        for i in reversed(range(len(boundaries))):
+            prefix_ids = self._cached_tokenize(prompt[: boundaries[i]])
+            # The last tokens may merge with the text after the boundary.
+            n = common_prefix_length(prefix_ids, ids)
+            if n <= cached_len or ids[:n] in self.prefix_cache:
+                continue
+            past.crop(n)
+            self.prefix_cache.put(ids[:n], copy.deepcopy(past), pin=i == 0)
 
-        return content
+    def _generate_batch(self, prompts: List[str]) -> List[str]:
+        """Generate content for several prompts in one padded batch"""
+        inputs = self.tokenizer.pad(
+            {"input_ids": [self._encode(prompt) for prompt in prompts]},
+            return_tensors="pt",
+        )
+        input_len = inputs["input_ids"].shape[1]
+        outputs = self.model.generate(**inputs, **self._generate_kwargs(input_len))
+        new_tokens = outputs[:, input_len:]
+        for i, mask in enumerate(inputs["attention_mask"]):
+            with batch_item(i):
+                record_tokens(
+                    int(mask.sum()),
+                    int((new_tokens[i] != self.tokenizer.pad_token_id).sum()),
+                )
+        return [
+            content.strip()
+            for content in self.tokenizer.batch_decode(
+                new_tokens, skip_special_tokens=True
+            )
+        ]
@@ -0,0 +1,108 @@
+"""
+Reuse of prompt prefill work across generations of local backends.
+"""
+
+import copy
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from dria_agent.agent.settings.prompt import PROMPT_FRAGMENTS
+
+
+def prefix_boundaries(prompt: str) -> List[int]:
+    """
+    Character offsets in a formatted prompt after which the prompt is shared with
+    other prompts: the end of the static instructions before the tool schemas, and the
+    end of the system prompt, which is shared by prompts retrieving the same tools.
+    """
+    # The static_first prefix is longer and contains no tool schemas, try it first.
+    for layout in ("static_first", "inline"):
+        prefix, suffix = PROMPT_FRAGMENTS[layout]
+        start = prompt.find(prefix)
+        if start == -1:
+            continue
+        boundaries = [start + len(prefix)]
+        end = prompt.find(suffix, boundaries[0])
+        if end != -1:
+            boundaries.append(end + len(suffix))
+        return boundaries
+    return []
+
+
+def common_prefix_length(a: Sequence[int], b: Sequence[int]) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class PrefixKVCache:
+    """
+    LRU of model KV caches for prompt prefixes, keyed by the prefix token ids.
+
+    lookup() returns a copy of the cache of the longest stored prefix, generation
+    continues from it and only prefills the rest of the prompt. Pinned entries, such
+    as the static system prompt prefix, are never evicted.
+
+    :param maxsize: Maximum number of unpinned entries.
+    """
+
+    def __init__(self, maxsize: int = 4):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[int, ...], Tuple[Any, bool]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, ids: Sequence[int]) -> bool:
+        return tuple(ids) in self._entries
+
+    def lookup(self, ids: Sequence[int]) -> Tuple[int, Optional[Any]]:
+        """Length of the longest stored strict prefix of ids and a copy of its cache."""
+        with self._lock:
+            best = None
+            for key in self._entries:
+                if (
+                    len(key) < len(ids)
+                    and (best is None or len(key) > len(best))
+                    and tuple(ids[: len(key)]) == key
+                ):
+                    best = key
+            if best is None:
+                self.misses += 1
+                return 0, None
+            self.hits += 1
+            self._entries.move_to_end(best)
+            kv = self._entries[best][0]
+        return len(best), copy.deepcopy(kv)
+
+    def put(self, ids: Sequence[int], kv: Any, pin: bool = False) -> None:
+        """Store the cache of a prefix, the cache must not be modified afterwards."""
+        if self.maxsize <= 0 and not pin:
+            return
+        key = tuple(ids)
+        with self._lock:
+            self._entries[key] = (kv, pin or self._entries.get(key, (None, False))[1])
+            self._entries.move_to_end(key)
+            unpinned = [k for k, (_, pinned) in self._entries.items() if not pinned]
+            for k in unpinned[: max(0, len(unpinned) - self.maxsize)]:
+                del self._entries[k]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
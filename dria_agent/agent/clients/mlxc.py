@@ -1,31 +1,56 @@
+import asyncio
+import contextvars
 import importlib.util
 import logging
 import math
+import threading
+from contextlib import closing
 from functools import partial
-from typing import List, Union, Callable, Dict, Tuple
-
-from rich.console import Console
-from rich.panel import Panel
-
-from dria_agent.agent.settings.prompt import system_prompt
-from dria_agent.pythonic.engine import execute_tool_call, async_execute_tool_call
-from dria_agent.pythonic.schemas import ExecutionResults
+from typing import List, Dict, AsyncIterator
+
+from dria_agent.agent.metrics import record_tokens
+from dria_agent.agent.registry import MODELS
+from dria_agent.agent.settings.generation import (
+    CODE_FENCE_STOP,
+    GenerationConfig,
+    should_stop,
+)
 from .base import ToolCallingAgentBase
+from .kv_cache import common_prefix_length
 
 logger = logging.getLogger(__name__)
 
 
 class MLXToolCallingAgent(ToolCallingAgentBase):
+    backend = "mlx"
+    default_generation = GenerationConfig(
+        max_tokens=750, stop=[CODE_FENCE_STOP], temperature=0.5, min_p=0.9
+    )
+
     def __init__(
-        self, embedding, tools: List, model: str = "driaforall/Tiny-Agent-a-3B-Q8-mlx"
+        self,
+        embedding,
+        tools: List,
+        model: str = "driaforall/Tiny-Agent-a-3B-Q8-mlx",
+        prompt_cache: bool = True,
+        **kwargs,
     ):
-        super().__init__(embedding, tools, model)
+        """
+        :param prompt_cache: Keep the KV cache of the previous prompt and only prefill the
+            part of the next prompt that differs from it.
+        """
+        super().__init__(embedding, tools, model, **kwargs)
         if importlib.util.find_spec("mlx_lm") is None:
             raise ImportError(
                 "Optional dependency 'mlx_lm' is not installed. Install it with: pip install 'dria-agent[mlx]'"
             )
         else:
-            from mlx_lm import load, generate
+            from mlx_lm import load, stream_generate
+            from mlx_lm.models.cache import (
+                can_trim_prompt_cache,
+                make_prompt_cache,
+                trim_prompt_cache,
+            )
             import mlx.core as mx
 
         # link [https://github.com/ml-explore/mlx-examples/blob/main/llms/mlx_lm/sample_utils.py]
@@ -116,133 +141,128 @@ class MLXToolCallingAgent(ToolCallingAgentBase):
             sorted_tokens = mx.random.categorical(selected_logprobs, axis=-1)[:, None]
             return mx.take_along_axis(sorted_indices, sorted_tokens, axis=-1).squeeze(1)
 
-        self.sampler = make_sampler(0.5, 0.9)
-        self.model, self.tokenizer = load(model)
-        self.generate = generate
-
-    def _prepare_messages(
-        self, query: Union[str, List[Dict]], num_tools: int
-    ) -> Tuple[str, List[Callable]]:
-        """Prepare messages and tools for execution"""
-        if num_tools <= 0 or num_tools > 5:
-            raise RuntimeError(
-                "Number of tools cannot be less than 0 or greater than 3 for optimal performance"
-            )
-
-        messages = (
-            [{"role": "user", "content": query}]
-            if isinstance(query, str)
-            else query.copy()
+        self.sampler = make_sampler(
+            self.generation.temperature or 0.0, self.generation.min_p or 0.0
         )
-
-        # Get search query from user messages
-        user_msgs = [m["content"] for m in messages if m["role"] == "user"]
-        search_query = (
-            user_msgs[-2]
-            if "Please re-think your response and fix errors" in user_msgs[-1]
-            else user_msgs[-1]
+        # Agents using the same model share it, and its lock as MLX generations on one
+        # model are not thread-safe.
+        self._model_key = (self.backend, model, None)
+        self.model, self.tokenizer = MODELS.acquire(
+            self.backend, model, lambda: load(model)
         )
-
-        # Get relevant tools
-        inds = self.db.nearest(search_query, k=num_tools)
-        tools = [list(self.tools.values())[ind] for ind in inds]
-        tool_info = "\n".join(str(tool) for tool in tools)
-
-        # Add system message
-        messages.insert(
-            0,
-            {
-                "role": "system",
-                "content": system_prompt.replace("{{functions_schema}}", tool_info),
-            },
-        )
-
-        # Generate prompt
-        prompt = (
+        self.stream_generate = stream_generate
+        self._make_prompt_cache = make_prompt_cache
+        self._can_trim_prompt_cache = can_trim_prompt_cache
+        self._trim_prompt_cache = trim_prompt_cache
+        self.prompt_cache = make_prompt_cache(self.model) if prompt_cache else None
+        # Prompt tokens at the start of prompt_cache, and a lock as the cache is shared.
+        self._cached_tokens: List[int] = []
+        self._cache_lock = MODELS.lock(*self._model_key)
+
+    def close(self) -> None:
+        super().close()
+        if self.model is not None:
+            self.model = None
+            self.prompt_cache = None
+            MODELS.release(*self._model_key)
+
+    def _format_prompt(self, messages: List[Dict]) -> str:
+        """Generate prompt"""
+        return (
             self.tokenizer.apply_chat_template(messages, add_generation_prompt=True)
             if getattr(self.tokenizer, "chat_template", None)
             else "\n".join(f"{m['role']}: {m['content']}" for m in messages)
         )
 
-        return prompt, [t.func for t in tools]
+    def _reuse_prompt_cache(self, tokens: List[int]) -> List[int]:
+        """Trim the prompt cache to the prefix shared with tokens, returns the tokens to prefill"""
+        offset = self.prompt_cache[0].offset
+        # Keep at least one token to prefill, generation starts from its logits.
+        common = min(
+            common_prefix_length(self._cached_tokens, tokens), len(tokens) - 1, offset
+        )
+        if offset > common:
+            if self._can_trim_prompt_cache(self.prompt_cache):
+                self._trim_prompt_cache(self.prompt_cache, offset - common)
+            else:
+                self.prompt_cache = self._make_prompt_cache(self.model)
+                common = 0
+        self._cached_tokens = tokens
+        return tokens[common:]
+
+    def _stream(self, prompt):
+        """Yield generated text pieces, one per token"""
+        with self._cache_lock:
+            kwargs = {}
+            if self.prompt_cache is not None:
+                tokens = (
+                    prompt
+                    if isinstance(prompt, list)
+                    else self.tokenizer.encode(prompt)
+                )
+                prompt = self._reuse_prompt_cache(tokens)
+                kwargs["prompt_cache"] = self.prompt_cache
+            for response in self.stream_generate(
+                self.model,
+                self.tokenizer,
+                prompt=prompt,
+                max_tokens=self.generation.max_tokens,
+                sampler=self.sampler,
+                **kwargs,
+            ):
+                # Older mlx_lm versions yield text, newer ones response objects.
+                yield getattr(response, "text", response)
 
     def _generate_content(self, prompt: str) -> str:
-        """Generate content from prompt"""
-        content = self.generate(
-            self.model,
-            self.tokenizer,
-            prompt=prompt,
-            verbose=False,
-            max_tokens=750,
-            sampler=self.sampler,
-        )
+        """Generate content from prompt, stopping at the first stop sequence"""
+        content = ""
+        completion_tokens = 0
+        with closing(self._stream(prompt)) as stream:
+            for text in stream:
+                completion_tokens += 1
+                content += text
+                if "<|endoftext|>" in content or should_stop(
+                    content, self.generation.stop
+                ):
+                    break
+        record_tokens(self._count_tokens(prompt), completion_tokens)
         return content.split("<|endoftext|>")[0].strip()
 
-    def _display_completion(self, content: str) -> None:
-        """Display completion in console"""
-        console = Console()
-        console.rule("[bold blue]Agent Response")
-        panel = Panel(content, title="Agent", subtitle="End of Response", expand=False)
-        console.print(panel)
-        console.rule()
-
-    def run(
-        self,
-        query: Union[str, List[Dict]],
-        dry_run: bool = False,
-        show_completion: bool = True,
-        num_tools: int = 2,
-    ) -> ExecutionResults:
-        """Run agent synchronously"""
-        prompt, tools = self._prepare_messages(query, num_tools)
-        content = self._generate_content(prompt)
-
-        if show_completion:
-            self._display_completion(content)
-
-        if dry_run:
-            return ExecutionResults(
-                content=content, results={}, data={}, errors=[], is_dry=True
-            )
-
-        return execute_tool_call(completion=content, functions=tools)
-
-    async def async_run(
-        self,
-        query: Union[str, List[Dict]],
-        dry_run: bool = False,
-        show_completion: bool = True,
-        num_tools: int = 2,
-    ) -> ExecutionResults:
-        """Run agent asynchronously"""
-        prompt, tools = self._prepare_messages(query, num_tools)
-        content = self._generate_content(prompt)
-
-        if show_completion:
-            self._display_completion(content)
-
-        if dry_run:
-            return ExecutionResults(
-                content=content, results={}, data={}, errors=[], is_dry=True
-            )
-
-        return await async_execute_tool_call(completion=content, functions=tools)
-
-    def instruct(self, query: Union[str, List[Dict]], show_completion: bool = False):
-
-        messages = (
-            [{"role": "user", "content": query}]
-            if isinstance(query, str)
-            else query.copy()
+    def _count_tokens(self, prompt) -> int:
+        return (
+            len(prompt)
+            if isinstance(prompt, list)
+            else len(self.tokenizer.encode(prompt))
         )
 
-        prompt = (
-            self.tokenizer.apply_chat_template(messages, add_generation_prompt=True)
-            if getattr(self.tokenizer, "chat_template", None)
-            else "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    async def _async_stream_content(self, prompt: str) -> AsyncIterator[str]:
+        """Stream content from prompt, generating on the executor thread"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                with closing(self._stream(prompt)) as stream:
+                    for text in stream:
+                        if stop.is_set():
+                            break
+                        loop.call_soon_threadsafe(queue.put_nowait, text)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        producer = loop.run_in_executor(
+            self._executor, contextvars.copy_context().run, produce
         )
-        content = self._generate_content(prompt)
-        if show_completion:
-            self._display_completion("Instruct Mode: \n\n" + content)
-
-        return content
+        completion_tokens = 0
+        try:
+            while (text := await queue.get()) is not None:
+                completion_tokens += 1
+                if "<|endoftext|>" in text:
+                    yield text.split("<|endoftext|>")[0]
+                    break
+                yield text
+            await producer
+        finally:
+            stop.set()
+            record_tokens(self._count_tokens(prompt), completion_tokens)
@@ -1,139 +1,79 @@
-from typing import List, Union, Dict, Callable, Tuple
+from typing import List, Dict, AsyncIterator
 import importlib.util
 import logging
 
-from dria_agent.agent.settings.prompt import system_prompt
+from dria_agent.agent.metrics import record_tokens
+from dria_agent.agent.settings.generation import CODE_FENCE_STOP, GenerationConfig
 from .base import ToolCallingAgentBase
-from dria_agent.pythonic.schemas import ExecutionResults
-from dria_agent.pythonic.engine import execute_tool_call, async_execute_tool_call
-from rich.console import Console
-from rich.panel import Panel
 
 logger = logging.getLogger(__name__)
 
 
 class OllamaToolCallingAgent(ToolCallingAgentBase):
+    backend = "ollama"
+    default_generation = GenerationConfig(
+        stop=[CODE_FENCE_STOP], temperature=0.5, min_p=0.9
+    )
+    # Generation runs in the Ollama server, async calls go through AsyncClient.
+    generation_workers = 4
+
     def __init__(
-        self, embedding, tools: List, model: str = "driaforall/tiny-agent-a:3b-q8_0"
+        self,
+        embedding,
+        tools: List,
+        model: str = "driaforall/tiny-agent-a:3b-q8_0",
+        **kwargs,
     ):
-        super().__init__(embedding, tools, model)
+        super().__init__(embedding, tools, model, **kwargs)
         if importlib.util.find_spec("ollama") is None:
             raise ImportError(
                 "Optional dependency 'ollama' is not installed. Install it with: pip install 'dria-agent[ollama]'"
             )
         else:
-            from ollama import chat
+            from ollama import chat, AsyncClient
 
             self.chat = chat
-
-    def _prepare_messages(
-        self, query: Union[str, List[Dict]], num_tools: int
-    ) -> Tuple[List, List[Callable]]:
-        """Prepare messages and tools for execution"""
-        if num_tools <= 0 or num_tools > 5:
-            raise RuntimeError(
-                "Number of tools cannot be less than 0 or greater than 3 for optimal performance"
-            )
-
-        messages = (
-            [{"role": "user", "content": query}]
-            if isinstance(query, str)
-            else query.copy()
-        )
-
-        # Get search query from user messages
-        user_msgs = [m["content"] for m in messages if m["role"] == "user"]
-        search_query = (
-            user_msgs[-2]
-            if "Please re-think your response and fix errors" in user_msgs[-1]
-            else user_msgs[-1]
-        )
-
-        # Get relevant tools
-        inds = self.db.nearest(search_query, k=num_tools)
-        tools = [list(self.tools.values())[ind] for ind in inds]
-        tool_info = "\n".join(str(tool) for tool in tools)
-
-        # Add system message
-        messages.insert(
-            0,
-            {
-                "role": "system",
-                "content": system_prompt.replace("{{functions_schema}}", tool_info),
-            },
-        )
-
-        return messages, [t.func for t in tools]
+            self.async_client = AsyncClient()
+
+    @property
+    def options(self) -> Dict:
+        """Ollama options of the current generation config"""
+        options = {
+            "num_predict": self.generation.max_tokens,
+            "stop": self.generation.stop,
+            "temperature": self.generation.temperature,
+            "min_p": self.generation.min_p,
+        }
+        return {k: v for k, v in options.items() if v is not None}
 
     def _generate_content(self, messages: List[Dict]) -> str:
         """Generate content from messages"""
-        response = self.chat(
-            model=self.model,
-            messages=messages,
-            options={"temperature": 0.5, "min_p": 0.9},
-        )
+        response = self.chat(model=self.model, messages=messages, options=self.options)
+        record_tokens(response.prompt_eval_count or 0, response.eval_count or 0)
         return response.message.content
 
-    def _display_completion(self, content: str) -> None:
-        """Display completion in console"""
-        console = Console()
-        console.rule("[bold blue]Agent Response")
-        panel = Panel(content, title="Agent", subtitle="End of Response", expand=False)
-        console.print(panel)
-        console.rule()
-
-    def run(
-        self,
-        query: Union[str, List[Dict]],
-        dry_run: bool = False,
-        show_completion: bool = True,
-        num_tools: int = 2,
-    ) -> ExecutionResults:
-        """Run agent synchronously"""
-        messages, tools = self._prepare_messages(query, num_tools)
-        content = self._generate_content(messages)
-
-        if show_completion:
-            self._display_completion(content)
-
-        if dry_run:
-            return ExecutionResults(
-                content=content, results={}, data={}, errors=[], is_dry=True
-            )
-
-        return execute_tool_call(completion=content, functions=tools)
-
-    async def async_run(
-        self,
-        query: Union[str, List[Dict]],
-        dry_run: bool = False,
-        show_completion: bool = True,
-        num_tools: int = 2,
-    ) -> ExecutionResults:
-        """Run agent asynchronously"""
-        messages, tools = self._prepare_messages(query, num_tools)
-        content = self._generate_content(messages)
-
-        if show_completion:
-            self._display_completion(content)
-
-        if dry_run:
-            return ExecutionResults(
-                content=content, results={}, data={}, errors=[], is_dry=True
-            )
-
-        return await async_execute_tool_call(completion=content, functions=tools)
-
-    def instruct(self, query: Union[str, List[Dict]], show_completion: bool = False):
-
-        messages = (
-            [{"role": "user", "content": query}]
-            if isinstance(query, str)
-            else query.copy()
+    async def _async_generate_content(self, messages: List[Dict]) -> str:
+        """Generate content from messages with the async Ollama client"""
+        response = await self.async_client.chat(
+            model=self.model, messages=messages, options=self.options
         )
+        record_tokens(response.prompt_eval_count or 0, response.eval_count or 0)
+        return response.message.content
 
-        content = self._generate_content(messages)
-        if show_completion:
-            self._display_completion("Instruct Mode: \n\n" + content)
-
-        return content
+    async def _async_stream_content(self, messages: List[Dict]) -> AsyncIterator[str]:
+        """Stream content from messages with the async Ollama client"""
+        stream = await self.async_client.chat(
+            model=self.model, messages=messages, options=self.options, stream=True
+        )
+        prompt_tokens, completion_tokens = 0, 0
+        try:
+            async for part in stream:
+                completion_tokens += 1
+                if part.done:
+                    prompt_tokens = part.prompt_eval_count or 0
+                    completion_tokens = part.eval_count or completion_tokens
+                yield part.message.content
+        finally:
+            # Closing the response makes the server stop generating.
+            await stream.aclose()
+            record_tokens(prompt_tokens, completion_tokens)
@@ -1,51 +1,132 @@
 import numpy as np
 from abc import ABC, abstractmethod
-from typing import Union, List
+from typing import Union, List, Optional, Dict
+from dria_agent.agent.cache import LRUCache
+from dria_agent.agent.registry import MODELS
 from dria_agent.agent.tool import ToolCall
 
 
 class BaseEmbedding(ABC):
-    def __init__(self, model_name: str, dim: int):
+    query_prefix = "Represent this sentence for searching relevant passages: "
+
+    def __init__(
+        self,
+        model_name: str,
+        dim: int,
+        query_cache_size: int = 256,
+        query_cache_ttl: Optional[float] = None,
+    ):
+        """
+        :param model_name: Name of the embedding model.
+        :param dim: Embedding dimension.
+        :param query_cache_size: Number of query embeddings kept in memory, 0 disables caching.
+        :param query_cache_ttl: Optional lifetime of a cached query embedding in seconds.
+        """
         self.model_name = model_name
         self.dim = dim
+        self.query_cache = LRUCache(maxsize=query_cache_size, ttl=query_cache_ttl)
 
     @abstractmethod
     def batch_embed(self, texts: List[Union[ToolCall, str]]) -> np.ndarray:
         pass
 
     @abstractmethod
-    def embed_query(self, text: str) -> np.ndarray:
+    def _embed_query(self, text: str) -> np.ndarray:
         pass
 
+    def _batch_embed_query(self, texts: List[str]) -> np.ndarray:
+        return np.stack([np.asarray(self._embed_query(t)).reshape(-1) for t in texts])
+
+    def embed_query(self, text: str) -> np.ndarray:
+        embedding = self.query_cache.get(text)
+        if embedding is None:
+            embedding = np.asarray(self._embed_query(text))
+            embedding.setflags(write=False)
+            self.query_cache.put(text, embedding)
+        return embedding
+
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        """Embed several queries, cache misses are embedded in a single batch."""
+        cached = [self.query_cache.get(t) for t in texts]
+        missing = list(dict.fromkeys(t for t, e in zip(texts, cached) if e is None))
+        fresh = {}
+        if missing:
+            for t, e in zip(missing, self._batch_embed_query(missing)):
+                e.setflags(write=False)
+                self.query_cache.put(t, e)
+                fresh[t] = e
+        return np.stack(
+            [
+                np.asarray(e if e is not None else fresh[t]).reshape(-1)
+                for t, e in zip(texts, cached)
+            ]
+        )
+
+    def cache_info(self) -> Dict[str, int]:
+        """Hit/miss counters of the query embedding cache."""
+        return self.query_cache.info()
+
     def embed(self, text: Union[ToolCall, str]) -> np.ndarray:
         return self.batch_embed([text])[0]
 
+    def close(self) -> None:
+        """Release the resources of the embedding model."""
+        pass
+
 
 class OllamaEmbedding(BaseEmbedding):
-    def __init__(self, model_name: str = "snowflake-arctic-embed:m", dim: int = 768):
-        super().__init__(model_name, dim)
+    def __init__(
+        self,
+        model_name: str = "snowflake-arctic-embed:m",
+        dim: int = 768,
+        query_cache_size: int = 256,
+        query_cache_ttl: Optional[float] = None,
+    ):
+        super().__init__(model_name, dim, query_cache_size, query_cache_ttl)
         self.ollama = __import__("ollama")
 
     def batch_embed(self, texts: List[Union[ToolCall, str]]) -> np.ndarray:
         results = self.ollama.embed(model=self.model_name, input=texts)
         return np.array(results.embeddings, dtype=np.float16)
 
-    def embed_query(self, text: str) -> np.ndarray:
-        text = "Represent this sentence for searching relevant passages: " + text
+    def _embed_query(self, text: str) -> np.ndarray:
+        text = self.query_prefix + text
         results = self.ollama.embed(model=self.model_name, input=text)
         return np.array(results.embeddings, dtype=np.float16)
 
+    def _batch_embed_query(self, texts: List[str]) -> np.ndarray:
+        texts = [self.query_prefix + t for t in texts]
+        results = self.ollama.embed(model=self.model_name, input=texts)
+        return np.array(results.embeddings, dtype=np.float16)
+
 
 class HuggingFaceEmbedding(BaseEmbedding):
-    def __init__(self, dim: int = 768, model_name="Snowflake/snowflake-arctic-embed-m"):
-        super().__init__(model_name, dim)
+    def __init__(
+        self,
+        dim: int = 768,
+        model_name="Snowflake/snowflake-arctic-embed-m",
+        query_cache_size: int = 256,
+        query_cache_ttl: Optional[float] = None,
+    ):
+        super().__init__(model_name, dim, query_cache_size, query_cache_ttl)
         from sentence_transformers import SentenceTransformer
 
-        self.model = SentenceTransformer(model_name)
+        # Shared with the other agents embedding with the same model.
+        self.model = MODELS.acquire(
+            "sentence-transformers", model_name, lambda: SentenceTransformer(model_name)
+        )
+
+    def close(self) -> None:
+        if self.model is not None:
+            self.model = None
+            MODELS.release("sentence-transformers", self.model_name)
 
     def batch_embed(self, texts: List[Union[ToolCall, str]]) -> np.ndarray:
         return self.model.encode(texts)
 
-    def embed_query(self, text: str) -> np.ndarray:
-        text = "Represent this sentence for searching relevant passages: " + text
+    def _embed_query(self, text: str) -> np.ndarray:
+        text = self.query_prefix + text
         return self.model.encode(text)
+
+    def _batch_embed_query(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode([self.query_prefix + t for t in texts])
@@ -66,7 +66,7 @@ class MCPToolAdapter:
         """
         self.config_manager = MCPConfigManager(config_path)
         self.clients: Dict[str, MCPClient] = {}
-        self._tools: List[ToolCall] = []
+        self._server_tools: Dict[str, List[ToolCall]] = {}
 
     async def connect_server(self, server_name: str) -> None:
         """Connect to an MCP server and load its tools
@@ -78,10 +78,11 @@ class MCPToolAdapter:
         await client.connect()
         self.clients[server_name] = client
 
-        # Convert MCP tools to Dria Agent tools
-        for tool_info in client.available_tools:
-            tool_call = create_mcp_tool_executor(client, tool_info["name"], tool_info)
-            self._tools.append(tool_call)
+        # Convert MCP tools to Dria Agent tools, replacing the ones from a previous connection
+        self._server_tools[server_name] = [
+            create_mcp_tool_executor(client, tool_info["name"], tool_info)
+            for tool_info in client.available_tools
+        ]
 
     async def connect_servers(self) -> None:
         """Connect to multiple MCP servers and load their tools"""
@@ -110,4 +111,4 @@ class MCPToolAdapter:
     @property
     def tools(self) -> List[ToolCall]:
         """Get all tools from connected MCP servers"""
-        return self._tools
+        return [t for tools in self._server_tools.values() for t in tools]
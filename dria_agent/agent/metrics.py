@@ -0,0 +1,246 @@
+"""
+In-process metrics for agent runs: counters and histograms, per-run records attached to
+ExecutionResults, and an optional Prometheus text exporter.
+"""
+
+import bisect
+import contextvars
+import logging
+import math
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple, Any
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 25, 50, 100, 200, 400, 800)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Thread-safe store of labelled counters, gauges and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._gauges: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, Tuple]:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+        **labels,
+    ) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current values as plain dicts, keyed by metric name and label string."""
+
+        def label_str(labels):
+            return ",".join(f"{k}={v}" for k, v in labels)
+
+        with self._lock:
+            return {
+                "counters": {
+                    f"{name}{{{label_str(labels)}}}": v
+                    for (name, labels), v in self._counters.items()
+                },
+                "gauges": {
+                    f"{name}{{{label_str(labels)}}}": v
+                    for (name, labels), v in self._gauges.items()
+                },
+                "histograms": {
+                    f"{name}{{{label_str(labels)}}}": {
+                        "count": h.count,
+                        "sum": h.sum,
+                    }
+                    for (name, labels), h in self._histograms.items()
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for kind, store in (("counter", self._counters), ("gauge", self._gauges)):
+                typed = set()
+                for (name, labels), value in sorted(store.items()):
+                    if name not in typed:
+                        lines.append(f"# TYPE {name} {kind}")
+                        typed.add(name)
+                    lines.append(f"{name}{fmt(labels)} {value}")
+            typed = set()
+            for (name, labels), h in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else repr(float(bound))
+                    lines.append(
+                        f"{name}_bucket{fmt(labels, [('le', le)])} {cumulative}"
+                    )
+                lines.append(f"{name}_sum{fmt(labels)} {h.sum}")
+                lines.append(f"{name}_count{fmt(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry used by all agents.
+METRICS = MetricsRegistry()
+
+
+@dataclass
+class RunMetrics:
+    """Metrics of a single agent run, attached to its ExecutionResults."""
+
+    backend: str
+    stages: Dict[str, float] = field(default_factory=dict)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    tokens_per_second: Optional[float] = None
+    tool_calls: Dict[str, int] = field(default_factory=dict)
+    errors: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+_current_run: contextvars.ContextVar[Optional[RunMetrics]] = contextvars.ContextVar(
+    "dria_agent_run_metrics", default=None
+)
+# Runs of the items of a batch being generated together, see collect_batch.
+_batch_runs: contextvars.ContextVar[Optional[List[Optional[RunMetrics]]]] = (
+    contextvars.ContextVar("dria_agent_batch_runs", default=None)
+)
+
+
+def current_run() -> Optional[RunMetrics]:
+    """The metrics record of the run executing in the current context, if any."""
+    return _current_run.get()
+
+
+@contextmanager
+def collect_run(backend: str, run: Optional[RunMetrics] = None):
+    """Make run, or a fresh RunMetrics, the current run for the duration of the block."""
+    run = run if run is not None else RunMetrics(backend=backend)
+    token = _current_run.set(run)
+    try:
+        yield run
+    finally:
+        _current_run.reset(token)
+
+
+def batch_runs() -> List[RunMetrics]:
+    """The runs of the batch processed in the current context, if any."""
+    return [run for run in _batch_runs.get() or [] if run is not None]
+
+
+@contextmanager
+def collect_batch(runs: List[Optional[RunMetrics]]):
+    """
+    Process a batch of items submitted by different runs. Inside the block no run is
+    current, use batch_item(i) to attribute metrics to the run of item i.
+    """
+    runs_token = _batch_runs.set(runs)
+    run_token = _current_run.set(None)
+    try:
+        yield
+    finally:
+        _current_run.reset(run_token)
+        _batch_runs.reset(runs_token)
+
+
+@contextmanager
+def batch_item(index: int):
+    """Make the run of the index-th item of the current batch the current run."""
+    runs = _batch_runs.get()
+    token = _current_run.set(runs[index] if runs is not None else _current_run.get())
+    try:
+        yield
+    finally:
+        _current_run.reset(token)
+
+
+def record_tokens(prompt_tokens: int, completion_tokens: int) -> None:
+    """Record token usage of a generation on the current run, called by backends."""
+    run = _current_run.get()
+    if run is not None:
+        run.prompt_tokens += prompt_tokens
+        run.completion_tokens += completion_tokens
+
+
+def start_metrics_server(
+    port: int = 9464, host: str = "127.0.0.1", registry: MetricsRegistry = METRICS
+) -> ThreadingHTTPServer:
+    """
+    Serve the registry in Prometheus text format on http://host:port/metrics
+    from a daemon thread. Call shutdown() on the returned server to stop it.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,166 @@
+"""
+Process-wide registry sharing loaded models between agents.
+"""
+
+import gc
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dria_agent.agent.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+ModelKey = Tuple[str, str, Optional[str]]
+
+
+def model_memory_bytes(model: Any) -> int:
+    """
+    Approximate memory of a model's weights: the sum of the sizes of its torch
+    parameters and buffers, or of its MLX arrays. Tuples such as (model, tokenizer) sum
+    their items, unknown objects count as 0.
+    """
+    if isinstance(model, (tuple, list)):
+        return sum(model_memory_bytes(m) for m in model)
+    if hasattr(model, "get_memory_footprint"):
+        return int(model.get_memory_footprint())
+    if hasattr(model, "parameters") and hasattr(model, "buffers"):
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    if hasattr(model, "parameters"):
+        try:
+            from mlx.utils import tree_flatten
+        except ImportError:
+            return 0
+        return sum(a.nbytes for _, a in tree_flatten(model.parameters()))
+    return 0
+
+
+@dataclass
+class _Entry:
+    model: Any = None
+    refs: int = 0
+    bytes: int = 0
+    # Held while loading, and by backends serializing generations on a shared model.
+    lock: threading.RLock = field(default_factory=threading.RLock)
+
+
+class ModelRegistry:
+    """
+    Reference-counted models keyed by (backend, model name, dtype).
+
+    acquire() loads a model on first use and returns the loaded instance to later
+    callers, release() drops a reference and unloads the model once no agent uses it.
+    Agents with different tool sets but the same models thus hold one copy of each.
+    """
+
+    def __init__(self):
+        self._entries: Dict[ModelKey, _Entry] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, key: ModelKey) -> _Entry:
+        with self._lock:
+            return self._entries.setdefault(key, _Entry())
+
+    def acquire(
+        self,
+        backend: str,
+        model: str,
+        loader: Callable[[], Any],
+        dtype: Optional[str] = None,
+    ) -> Any:
+        """
+        Return the loaded model for the key, loading it with loader() if needed.
+
+        :param backend: Backend the model is loaded for, e.g. "huggingface".
+        :param model: Model name or path.
+        :param loader: Callable loading the model.
+        :param dtype: Weight dtype or quantization, models in other dtypes are distinct.
+        """
+        key = (backend, model, dtype)
+        while True:
+            entry = self._entry(key)
+            with entry.lock:
+                # The entry may have been unloaded while waiting for its lock.
+                with self._lock:
+                    if self._entries.get(key) is not entry:
+                        continue
+                if entry.model is None:
+                    logger.info(
+                        f"Loading {backend} model {model} ({dtype or 'default'})"
+                    )
+                    entry.model = loader()
+                    entry.bytes = model_memory_bytes(entry.model)
+                entry.refs += 1
+                loaded = entry.model
+            break
+        self._update_gauges()
+        return loaded
+
+    def release(self, backend: str, model: str, dtype: Optional[str] = None) -> None:
+        """Drop a reference to a model, unloading it when it was the last one."""
+        key = (backend, model, dtype)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return
+        with entry.lock:
+            entry.refs = max(0, entry.refs - 1)
+            if entry.refs == 0:
+                self._unload(key, entry)
+        self._update_gauges()
+
+    def unload(self, backend: str, model: str, dtype: Optional[str] = None) -> None:
+        """Unload a model regardless of its references."""
+        key = (backend, model, dtype)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return
+        with entry.lock:
+            if entry.refs:
+                logger.warning(f"Unloading {model} still used by {entry.refs} agents")
+            entry.refs = 0
+            self._unload(key, entry)
+        self._update_gauges()
+
+    def _unload(self, key: ModelKey, entry: _Entry) -> None:
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.model = None
+        entry.bytes = 0
+        gc.collect()
+
+    def lock(self, backend: str, model: str, dtype: Optional[str] = None):
+        """Lock shared by all users of a model."""
+        return self._entry((backend, model, dtype)).lock
+
+    def memory_bytes(self) -> int:
+        """Total approximate memory of the loaded models."""
+        with self._lock:
+            return sum(entry.bytes for entry in self._entries.values())
+
+    def info(self) -> List[Dict[str, Any]]:
+        """Loaded models with their reference counts and approximate memory."""
+        with self._lock:
+            return [
+                {
+                    "backend": backend,
+                    "model": model,
+                    "dtype": dtype,
+                    "refs": entry.refs,
+                    "bytes": entry.bytes,
+                }
+                for (backend, model, dtype), entry in self._entries.items()
+                if entry.model is not None
+            ]
+
+    def _update_gauges(self) -> None:
+        models = self.info()
+        METRICS.set("dria_agent_models_loaded", len(models))
+        METRICS.set("dria_agent_model_memory_bytes", sum(m["bytes"] for m in models))
+
+
+MODELS = ModelRegistry()
@@ -0,0 +1,70 @@
+from dataclasses import dataclass, fields, replace
+from typing import List, Optional
+
+from dria_agent.pythonic.util import code_block_end
+
+# Stop right after the closing fence of the python code block, the model only adds
+# reasoning we throw away after it.
+CODE_FENCE_STOP = "\n```\n"
+
+
+@dataclass(frozen=True)
+class GenerationConfig:
+    """
+    Generation parameters shared by all backends. Fields left as None use the
+    backend's default.
+
+    :param max_tokens: Maximum number of generated tokens.
+    :param stop: Stop sequences, generation ends at the first one.
+    :param temperature: Sampling temperature.
+    :param min_p: Minimum token probability relative to the most likely token.
+    """
+
+    max_tokens: Optional[int] = None
+    stop: Optional[List[str]] = None
+    temperature: Optional[float] = None
+    min_p: Optional[float] = None
+
+    def merge(self, other: Optional["GenerationConfig"]) -> "GenerationConfig":
+        """Override fields of this config with the fields set in other."""
+        if other is None:
+            return self
+        return replace(
+            self,
+            **{
+                f.name: getattr(other, f.name)
+                for f in fields(other)
+                if getattr(other, f.name) is not None
+            },
+        )
+
+
+def close_code_block(text: str) -> str:
+    """Re-append the closing fence of a python code block cut off by a stop sequence."""
+    if "```python" in text and code_block_end(text) is None:
+        return text.rstrip() + "\n```"
+    return text
+
+
+def apply_stop(text: str, stop: Optional[List[str]]) -> str:
+    """
+    Cut a completion at its stop sequences, keeping the code block closed when the
+    code fence stop is one of them.
+    """
+    fence = CODE_FENCE_STOP in (stop or [])
+    if fence:
+        end = code_block_end(text)
+        if end is not None:
+            text = text[:end]
+    for sequence in stop or []:
+        index = text.find(sequence)
+        if index != -1:
+            text = text[:index]
+    return close_code_block(text) if fence else text
+
+
+def should_stop(text: str, stop: Optional[List[str]]) -> bool:
+    """Whether a partial completion reached a stop sequence or closed its code block."""
+    if CODE_FENCE_STOP in (stop or []) and code_block_end(text) is not None:
+        return True
+    return any(sequence in text for sequence in stop or [])
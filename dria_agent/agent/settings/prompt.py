@@ -1,3 +1,5 @@
+from typing import List
+
 system_prompt = """You are an expert AI assistant that specializes in providing Python code to solve the task/problem at hand provided by the user.
 
 You can use Python code freely, including the following available functions:
@@ -24,3 +26,61 @@ result2 = example_function2(result, arg2)
 ```
 
 DO NOT use print() statements AT ALL. Avoid mutating variables whenever possible."""
+
+
+# Same instructions with the tool schemas last, so everything before them is identical
+# across requests and can be reused by the prompt caches of inference servers.
+static_first_system_prompt = """You are an expert AI assistant that specializes in providing Python code to solve the task/problem at hand provided by the user.
+
+You can use Python code freely, including the available functions listed at the end of this message.
+
+The following dangerous builtins are restricted for security:
+- exec
+- eval
+- execfile
+- compile
+- importlib
+- input
+- exit
+
+Think step by step and provide your reasoning, outside of the function calls.
+You can write Python code and use the available functions. Provide all your python code in a SINGLE markdown code block like the following:
+
+```python
+result = example_function(arg1, "string")
+result2 = example_function2(result, arg2)
+```
+
+DO NOT use print() statements AT ALL. Avoid mutating variables whenever possible.
+
+Available functions:
+
+<|functions_schema|>
+{{functions_schema}}
+<|end_functions_schema|>"""
+
+PROMPT_LAYOUTS = {"inline": system_prompt, "static_first": static_first_system_prompt}
+
+# Split once at import, so rendering the prompt is a join of cached strings.
+PROMPT_FRAGMENTS = {
+    layout: tuple(template.split("{{functions_schema}}"))
+    for layout, template in PROMPT_LAYOUTS.items()
+}
+SYSTEM_PROMPT_PREFIX, SYSTEM_PROMPT_SUFFIX = PROMPT_FRAGMENTS["inline"]
+
+
+def render_system_prompt(schemas: List[str], layout: str = "inline") -> str:
+    """
+    Render the system prompt with the given tool schemas.
+
+    :param schemas: Tool schemas, in the order they are listed.
+    :param layout: "inline" lists the tools between the instructions, "static_first"
+        puts all instructions first and the tools last.
+    """
+    try:
+        prefix, suffix = PROMPT_FRAGMENTS[layout]
+    except KeyError:
+        raise ValueError(
+            f"Unknown prompt layout {layout!r}, expected one of {list(PROMPT_LAYOUTS)}"
+        )
+    return "".join((prefix, "\n".join(schemas), suffix))
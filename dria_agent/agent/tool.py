@@ -1,5 +1,6 @@
 import inspect
 import logging
+import sys
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +46,9 @@ class ToolCall:
             else None
         )
 
+        # Render the prompt schema once, prompt assembly only joins cached strings.
+        self.schema = sys.intern(self._render())
+
     @staticmethod
     def _extract_params_from_schema(schema):
         """Extract parameters from JSON schema"""
@@ -62,6 +66,10 @@ class ToolCall:
         return self.func(*args, **kwargs)
 
     def __repr__(self):
+        return self.schema
+
+    def _render(self) -> str:
+        """Render the tool as a Python stub with its signature and docstring."""
         # Build the parameter list string.
         params_list = []
         for name, meta in self.params.items():
@@ -3,42 +3,108 @@ A simple, lightweight vector database for handling tools larger/longer than cont
 """
 
 import logging
+from typing import Optional
 
 import numpy as np
 from ollama import ResponseError
 
+from .cache import EmbeddingCache
 from .embedder import BaseEmbedding
+from .index import INDEXES
 
 logger = logging.getLogger(__name__)
 
 
 class ToolDB:
-    def __init__(self, embedding: BaseEmbedding, max_size=1000):
+    def __init__(
+        self,
+        embedding: BaseEmbedding,
+        index: str = "flat",
+        max_memory: int = None,
+        cache: Optional[EmbeddingCache] = None,
+    ):
+        """
+        :param embedding: Embedding model used for tool schemas and queries.
+        :param index: Nearest neighbour index, "flat" (exact) or "hnsw" (approximate).
+        :param max_memory: Optional cap in bytes on the memory used by stored vectors.
+        :param cache: Optional on-disk cache consulted before embedding texts.
+        """
+        index_cls = INDEXES.get(index)
+        if index_cls is None:
+            raise ValueError(f"Unknown index type: {index}")
 
         self.embedding = embedding
-        self.vectors = np.full((max_size, self.embedding.dim), np.inf, dtype=np.float16)
-        self.count = 0
+        self.cache = cache
+        self.index = index_cls(self.embedding.dim, max_memory=max_memory)
 
-    def add(self, texts: list[str]):
+    @property
+    def count(self) -> int:
+        return self.index.count
+
+    def _embed(self, texts: list[str]) -> tuple[list[int], list[np.ndarray]]:
+        """Embed texts, returns the positions that could be embedded and their vectors."""
         try:
-            embeddings = self.embedding.batch_embed(texts)
+            return list(range(len(texts))), list(self.embedding.batch_embed(texts))
         except ResponseError:
-            embeddings = []
-            for t in texts:
+            embedded, embeddings = [], []
+            for i, t in enumerate(texts):
                 try:
                     embeddings.append(self.embedding.embed(t))
+                    embedded.append(i)
                 except ResponseError:
                     logger.info(
                         f"Doc string is too long for function {t.split()[1].split('(')[0]}"
                     )
                     continue
+            return embedded, embeddings
+
+    def add(self, texts: list[str]) -> np.ndarray:
+        """
+        Embed and store texts.
+
+        :return: The row id assigned to each text, or -1 if it could not be embedded.
+        """
+        if not texts:
+            return np.empty(0, dtype=np.int64)
+        if self.cache is None:
+            positions, embeddings = self._embed(texts)
+        else:
+            cached = self.cache.get(texts)
+            missing = [i for i, e in enumerate(cached) if e is None]
+            embedded, fresh = (
+                self._embed([texts[i] for i in missing]) if missing else ([], [])
+            )
+            if embedded:
+                self.cache.put([texts[missing[j]] for j in embedded], np.asarray(fresh))
+            self.cache.flush()
+            for j, e in zip(embedded, fresh):
+                cached[missing[j]] = e
+            positions = [i for i, e in enumerate(cached) if e is not None]
+            embeddings = [cached[i] for i in positions]
+
+        rows = np.full(len(texts), -1, dtype=np.int64)
+        if positions:
+            rows[positions] = self.index.add(np.asarray(embeddings))
+        return rows
 
-        for t, e in zip(texts, embeddings):
-            self.vectors[self.count] = e
-            self.count += 1
+    def remove(self, rows) -> None:
+        """Exclude rows from nearest() results until they are reclaimed by compact()."""
+        self.index.remove(rows)
+
+    def compact(self) -> np.ndarray:
+        """
+        Reclaim the space of removed rows.
+
+        :return: Array mapping each old row id to its new id, or -1 if it was removed.
+        """
+        return self.index.compact()
 
     def nearest(self, query, k=1):
         q = self.embedding.embed_query(query)
-        q = np.array(q, dtype=self.vectors.dtype)
-        dists = np.linalg.norm(self.vectors[: self.count] - q, axis=1)
-        return np.argsort(dists)[:k]
+        return self.index.search(np.asarray(q).reshape(-1), k)
+
+    def nearest_batch(self, queries: list[str], k=1) -> list[np.ndarray]:
+        """Nearest rows for each query, embedding and scoring all queries together."""
+        if not queries:
+            return []
+        return self.index.search_batch(self.embedding.embed_queries(queries), k)
@@ -1,7 +1,42 @@
 import asyncio
-from typing import Dict, Any, List, Callable
+import contextvars
+import hashlib
+import itertools
+import multiprocessing
+import pickle
+import re
+import signal
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from functools import partial
+from types import CodeType
+from typing import (
+    Dict,
+    Any,
+    FrozenSet,
+    List,
+    Callable,
+    NamedTuple,
+    Optional,
+    Union,
+    Tuple,
+)
 
-from .schemas import FunctionResults, ExecutionResults
+from dria_agent.agent.cache import LRUCache
+from dria_agent.agent.metrics import METRICS, MetricsRegistry
+
+from .rewriter import (
+    ASYNC_EXEC_NAME,
+    ASYNC_LOCALS_NAME,
+    GATHER_NAME,
+    OFFLOAD_NAME,
+    PARALLEL_NAME,
+    rewrite_async,
+    rewrite_sync,
+)
+from .schemas import ExecutionLimits, FunctionResults, ExecutionResults
 from .util import (
     extract_codeblocks,
     setup_logger,
@@ -11,9 +46,8 @@ from .util import (
 logger = setup_logger(__name__)
 
 
-def _create_execution_env(safe: bool = False) -> Dict[str, Any]:
-    """Create and return a sandboxed execution environment if safe=True."""
-    dangerous_builtins = [
+DANGEROUS_BUILTINS = frozenset(
+    [
         "exec",
         "eval",
         "execfile",
@@ -22,36 +56,364 @@ def _create_execution_env(safe: bool = False) -> Dict[str, Any]:
         "__import__",
         "input",
     ]
+)
 
-    env = {"__builtins__": __builtins__}
+# Compiled completions, keyed by the hash of their source. Completions are re-executed
+# as-is by evaluations and the feedback loop, compiling them is most of the overhead of
+# executing short code. Larger sources are compiled without caching.
+CODE_CACHE = LRUCache(maxsize=256)
+MAX_CACHED_SOURCE_CHARS = 64 * 1024
 
-    if safe:
-        env["__builtins__"] = {
-            k: v
-            for k, v in __builtins__.__dict__.items()
-            if k not in dangerous_builtins
+# Threads making concurrent calls of synchronous tools, shared by all executions.
+TOOL_WORKERS = 8
+
+# Base execution environments, built once per safe flag and cloned for every execution.
+_BASE_ENVS: Dict[bool, Dict[str, Any]] = {}
+
+
+def _base_env(safe: bool) -> Dict[str, Any]:
+    """The pre-imported environment every execution starts from."""
+    env = _BASE_ENVS.get(safe)
+    if env is None:
+        builtins_dict = (
+            __builtins__ if isinstance(__builtins__, dict) else __builtins__.__dict__
+        )
+        env = {
+            "__builtins__": (
+                {k: v for k, v in builtins_dict.items() if k not in DANGEROUS_BUILTINS}
+                if safe
+                else __builtins__
+            ),
+            "List": List,
+            "Dict": Dict,
+            "Any": Any,
+            "Union": Union,
+            "Tuple": Tuple,
+            "Callable": Callable,
+            "asyncio": asyncio,
+            "re": re,
+            "datetime": datetime,
+            "timedelta": timedelta,
         }
+        _BASE_ENVS[safe] = env
+    return env
 
+
+def _create_execution_env(safe: bool = False) -> Dict[str, Any]:
+    """
+    Create an execution environment with the common imports, sandboxed if safe=True.
+
+    The environment is a shallow copy of a base built once, so names the code defines
+    never reach the base. The sandboxed builtins are copied too, as code can modify them.
+    """
+    base = _base_env(safe)
+    env = dict(base)
+    if safe:
+        env["__builtins__"] = base["__builtins__"].copy()
     return env
 
 
-def _setup_env_imports(env: Dict[str, Any]) -> None:
-    """Set up common imports in the execution environment."""
-    exec("from typing import List, Dict, Any, Union, Tuple, Callable", env)
-    exec("import re", env)
-    exec("from datetime import datetime, timedelta", env)
+def _new_variables(env: Dict[str, Any], base: Dict[str, Any]) -> Dict[str, Any]:
+    """Variables the code or the context defined, excluding the base environment."""
+    return {
+        k: v
+        for k, v in env.items()
+        if not (k in base and base[k] is v)
+        and not k.startswith("__")
+        and not callable(v)
+    }
+
+
+class _Compiled(NamedTuple):
+    code: CodeType
+    # Source positions restoring the line by line order of results, see Rewrite.
+    positions: Optional[Dict[str, Tuple[int, int]]]
+
+
+def _compile(
+    source: str,
+    kind: str,
+    coroutines: FrozenSet[str] = frozenset(),
+    tools: FrozenSet[str] = frozenset(),
+    offloaded: FrozenSet[str] = frozenset(),
+) -> _Compiled:
+    """
+    Compile the source of an execution through the code cache.
+
+    :param source: Source to compile.
+    :param kind: "sync", "async", or "plain" for code run as-is.
+    :param coroutines: Names of the coroutine tools the async path awaits calls of.
+    :param tools: Names of the tools whose independent calls are made concurrently.
+    :param offloaded: Names of the synchronous tools the async path awaits calls of.
+    """
+    if len(source) > MAX_CACHED_SOURCE_CHARS:
+        return _compile_source(source, kind, coroutines, tools, offloaded)
+    key = (
+        kind,
+        hashlib.sha256(source.encode("utf-8")).hexdigest(),
+        coroutines,
+        tools,
+        offloaded,
+    )
+    compiled = CODE_CACHE.get(key)
+    METRICS.inc(
+        "dria_agent_code_cache_total",
+        kind=kind,
+        result="miss" if compiled is None else "hit",
+    )
+    if compiled is None:
+        compiled = _compile_source(source, kind, coroutines, tools, offloaded)
+        CODE_CACHE.put(key, compiled)
+    return compiled
+
+
+def _compile_source(
+    source: str,
+    kind: str,
+    coroutines: FrozenSet[str],
+    tools: FrozenSet[str],
+    offloaded: FrozenSet[str],
+) -> _Compiled:
+    if kind == "plain":
+        return _Compiled(compile(source, "<string>", "exec"), None)
+    if kind == "async":
+        rewrite = rewrite_async(source, coroutines, tools, offloaded)
+    else:
+        rewrite = rewrite_sync(source, tools)
+    return _Compiled(compile(rewrite.tree, "<string>", "exec"), rewrite.positions)
+
+
+def code_cache_info() -> Dict[str, int]:
+    """Hit/miss counters of the compiled code cache."""
+    return CODE_CACHE.info()
+
+
+# Ticket of the tool call made in the current context, set by the concurrent runners.
+_CALL_TICKET: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar(
+    "dria_agent_call_ticket", default=None
+)
+
+_TOOL_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_TOOL_EXECUTOR_LOCK = threading.Lock()
+
+
+def _tool_executor() -> ThreadPoolExecutor:
+    """Threads running the concurrent calls of synchronous tools."""
+    global _TOOL_EXECUTOR
+    with _TOOL_EXECUTOR_LOCK:
+        if _TOOL_EXECUTOR is None:
+            _TOOL_EXECUTOR = ThreadPoolExecutor(
+                max_workers=TOOL_WORKERS, thread_name_prefix="dria-tools"
+            )
+        return _TOOL_EXECUTOR
+
+
+class _CallLog:
+    """
+    Results of the tool calls of one execution. Calls take a ticket when they are
+    made, results are ordered by ticket whatever order concurrent calls finish in.
+    """
+
+    def __init__(self):
+        self._tickets = itertools.count()
+        self._records: List[Tuple[int, str, Any]] = []
+        self._lock = threading.Lock()
+
+    def ticket(self) -> int:
+        with self._lock:
+            return next(self._tickets)
+
+    def record(self, ticket: int, func_name: str, result: Any) -> None:
+        with self._lock:
+            self._records.append((ticket, func_name, result))
+
+    def results(self) -> Dict[str, List[Any]]:
+        call_results: Dict[str, List[Any]] = {}
+        for _, func_name, result in sorted(self._records, key=lambda r: r[0]):
+            call_results.setdefault(func_name, []).append(result)
+        return call_results
+
+
+class _Outcomes(list):
+    """Results of concurrent calls in order, with the exception of each failed call."""
+
+    def __init__(self, results: List[Any], errors: List[Optional[BaseException]]):
+        super().__init__(results)
+        self.errors = errors
+
+    def ok(self, index: int) -> bool:
+        return self.errors[index] is None
+
+    def reraise(self) -> None:
+        for error in self.errors:
+            if error is not None:
+                raise error
+
+
+def _parallel_calls(log: _CallLog, *calls: Tuple[Callable, tuple, dict]) -> _Outcomes:
+    """Make (func, args, kwargs) calls on threads, returning their outcomes in order."""
+    futures = []
+    for func, args, kwargs in calls:
+        context = contextvars.copy_context()
+        context.run(_CALL_TICKET.set, log.ticket())
+        futures.append(
+            _tool_executor().submit(context.run, partial(func, *args, **kwargs))
+        )
+    wait(futures)
+    errors = [future.exception() for future in futures]
+    return _Outcomes(
+        [None if e else future.result() for future, e in zip(futures, errors)],
+        errors,
+    )
+
+
+async def _gather_calls(
+    log: _CallLog, *calls: Tuple[Callable, tuple, dict]
+) -> _Outcomes:
+    """
+    Await (func, args, kwargs) calls concurrently, synchronous functions on threads,
+    returning their outcomes in order. The calls are cancelled if the caller is.
+    """
+    loop = asyncio.get_running_loop()
+    tasks = []
+    for func, args, kwargs in calls:
+        context = contextvars.copy_context()
+        context.run(_CALL_TICKET.set, log.ticket())
+        func = getattr(func, "offloaded", func)
+        if asyncio.iscoroutinefunction(func):
+            tasks.append(loop.create_task(func(*args, **kwargs), context=context))
+        else:
+            tasks.append(
+                loop.run_in_executor(
+                    _tool_executor(),
+                    context.run,
+                    partial(func, *args, **kwargs),
+                )
+            )
+    try:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    errors = [r if isinstance(r, BaseException) else None for r in results]
+    return _Outcomes([None if e else r for r, e in zip(results, errors)], errors)
+
+
+class ExecutionTimeoutError(TimeoutError):
+    """
+    A tool call or a whole completion exceeded its time budget.
+
+    :param scope: "tool", "completion", or "cpu" for the CPU time of a subprocess.
+    :param seconds: The exceeded budget.
+    :param name: Name of the tool, for tool calls.
+    """
+
+    def __init__(self, scope: str, seconds: float, name: Optional[str] = None):
+        self.scope = scope
+        self.seconds = seconds
+        self.name = name
+        subject = f"tool {name}" if name else "completion"
+        budget = "CPU time limit" if scope == "cpu" else "timeout"
+        super().__init__(f"TimeoutError: {subject} exceeded its {seconds:g}s {budget}")
+        METRICS.inc("dria_agent_execution_timeouts_total", scope=scope)
+
+
+class _Budget:
+    """Time budgets of one execution."""
+
+    def __init__(self, limits: Optional[ExecutionLimits]):
+        self.tool_timeout = limits.tool_timeout if limits else None
+        self.timeout = limits.timeout if limits else None
+        self.deadline = (
+            time.monotonic() + self.timeout if self.timeout is not None else None
+        )
+
+    @property
+    def active(self) -> bool:
+        return self.tool_timeout is not None or self.timeout is not None
+
+    def for_call(
+        self, name: str
+    ) -> Tuple[Optional[float], Callable[[], ExecutionTimeoutError]]:
+        """
+        Seconds a tool call may take, and a factory of the error raised when it takes
+        longer. Raises right away once the completion is out of time.
+        """
+        remaining = (
+            self.deadline - time.monotonic() if self.deadline is not None else None
+        )
+        if self.tool_timeout is not None and (
+            remaining is None or self.tool_timeout <= remaining
+        ):
+            return self.tool_timeout, partial(
+                ExecutionTimeoutError, "tool", self.tool_timeout, name
+            )
+        if remaining is not None:
+            error = partial(ExecutionTimeoutError, "completion", self.timeout)
+            if remaining <= 0:
+                raise error()
+            return remaining, error
+        return None, None
+
+
+def _start_daemon(fn: Callable[[], Any]) -> Future:
+    """
+    Run fn on a daemon thread. Unlike a pool worker, a thread stuck in a hung tool is
+    abandoned after its timeout without pinning a worker or blocking interpreter exit.
+    """
+    future = Future()
+    context = contextvars.copy_context()
+
+    def target():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(fn))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, name="dria-tool", daemon=True).start()
+    return future
+
+
+def _call_ticket(log: _CallLog) -> int:
+    ticket = _CALL_TICKET.get()
+    return log.ticket() if ticket is None else ticket
 
 
 def _make_sync_wrapper(
-    func_name: str, func: Callable, call_results: Dict, errors: List
+    func_name: str,
+    func: Callable,
+    log: _CallLog,
+    errors: List,
+    budget: Optional[_Budget] = None,
 ) -> Callable:
     """Create a synchronous wrapper function that captures return values."""
 
+    def call(*args, **kwargs):
+        if budget is None or not budget.active:
+            return func(*args, **kwargs)
+        seconds, error = budget.for_call(func_name)
+        if seconds is None:
+            return func(*args, **kwargs)
+        future = _start_daemon(partial(func, *args, **kwargs))
+        try:
+            return future.result(timeout=seconds)
+        except TimeoutError:
+            if future.done():
+                raise
+            raise error()
+
     def wrapper(*args, **kwargs):
+        ticket = _call_ticket(log)
         try:
-            result = func(*args, **kwargs)
-            call_results.setdefault(func_name, []).append(result)
+            result = call(*args, **kwargs)
+            log.record(ticket, func_name, result)
             return result
+        except ExecutionTimeoutError as e:
+            errors.append(str(e))
+            raise
         except Exception as e:
             errors.append(f"Error in {func_name}: {str(e)}")
             raise
@@ -60,32 +422,193 @@ def _make_sync_wrapper(
 
 
 async def _make_async_wrapper(
-    func_name: str, func: Callable, call_results: Dict, errors: List
+    func_name: str,
+    func: Callable,
+    log: _CallLog,
+    errors: List,
+    budget: Optional[_Budget] = None,
 ) -> Callable:
-    """Create an async wrapper function that captures return values."""
-    if asyncio.iscoroutinefunction(func):
+    """
+    Create an async wrapper function that captures return values. Synchronous tools
+    get a synchronous wrapper, so that they can still be used as values, whose
+    offloaded attribute is a coroutine running them on a thread, so that blocking
+    tools do not stall the event loop, and on a daemon thread with a time budget, so
+    that they can be abandoned on timeout.
+    """
 
-        async def wrapper(*args, **kwargs):
-            try:
-                result = await func(*args, **kwargs)
-                call_results.setdefault(func_name, []).append(result)
-                return result
-            except Exception as e:
-                errors.append(f"Error in {func_name}: {str(e)}")
+    async def call(*args, **kwargs):
+        # Raises before the call is made once the completion is out of time.
+        seconds, error = budget.for_call(func_name) if budget else (None, None)
+        if asyncio.iscoroutinefunction(func):
+            awaitable = func(*args, **kwargs)
+        elif budget is not None and budget.active:
+            awaitable = asyncio.wrap_future(
+                _start_daemon(partial(func, *args, **kwargs))
+            )
+        else:
+            awaitable = asyncio.get_running_loop().run_in_executor(
+                _tool_executor(),
+                contextvars.copy_context().run,
+                partial(func, *args, **kwargs),
+            )
+        if seconds is None:
+            return await awaitable
+        start = time.monotonic()
+        try:
+            # Cancels coroutine tools on timeout.
+            return await asyncio.wait_for(awaitable, seconds)
+        except asyncio.TimeoutError:
+            # A TimeoutError of the tool itself, raised before its budget ran out.
+            if time.monotonic() - start < seconds:
                 raise
+            raise error()
 
-    else:
+    async def wrapper(*args, **kwargs):
+        ticket = _call_ticket(log)
+        try:
+            result = await call(*args, **kwargs)
+            log.record(ticket, func_name, result)
+            return result
+        except ExecutionTimeoutError as e:
+            errors.append(str(e))
+            raise
+        except Exception as e:
+            errors.append(f"Error in {func_name}: {str(e)}")
+            raise
 
-        def wrapper(*args, **kwargs):
-            try:
-                result = func(*args, **kwargs)
-                call_results.setdefault(func_name, []).append(result)
-                return result
-            except Exception as e:
-                errors.append(f"Error in {func_name}: {str(e)}")
-                raise
+    if asyncio.iscoroutinefunction(func):
+        return wrapper
+    blocking = _make_sync_wrapper(func_name, func, log, errors, budget)
+    blocking.offloaded = wrapper
+    return blocking
 
-    return wrapper
+
+def _offload(func: Callable) -> Callable:
+    """
+    Coroutine variant of a synchronous tool wrapper. Other functions, such as those
+    the code rebinds a tool name to, are called as they are.
+    """
+    offloaded = getattr(func, "offloaded", None)
+    if offloaded is not None:
+        return offloaded
+    if asyncio.iscoroutinefunction(func):
+        return func
+
+    async def call(*args, **kwargs):
+        return func(*args, **kwargs)
+
+    return call
+
+
+def _add_error(errors: List[str], error: str) -> None:
+    # Timeouts raised by a tool wrapper are already recorded.
+    if error not in errors:
+        errors.append(error)
+
+
+def _picklable(value: Any) -> Any:
+    try:
+        pickle.dumps(value)
+        return value
+    except Exception:
+        return repr(value)
+
+
+def _run_child(connection, compiled, functions, context_variables, safe, limits):
+    """Subprocess entry point: apply the resource limits and send back the results."""
+    import resource
+
+    # Other threads of the parent may have held the locks of the tool executor and
+    # of the metrics when it forked, and the executor's threads are gone. The child
+    # gets its own, its metrics are dropped, and the code was compiled by the parent
+    # so that the code cache is not used.
+    global METRICS, _TOOL_EXECUTOR, _TOOL_EXECUTOR_LOCK
+    METRICS = MetricsRegistry()
+    _TOOL_EXECUTOR = None
+    _TOOL_EXECUTOR_LOCK = threading.Lock()
+
+    if limits.cpu_seconds is not None:
+        # SIGXCPU at the soft limit, SIGKILL a second later if it is handled.
+        resource.setrlimit(
+            resource.RLIMIT_CPU, (limits.cpu_seconds, limits.cpu_seconds + 1)
+        )
+    if limits.memory_bytes is not None:
+        resource.setrlimit(
+            resource.RLIMIT_AS, (limits.memory_bytes, limits.memory_bytes)
+        )
+    # The parent enforces the completion timeout by killing the process.
+    limits = limits.model_copy(update={"subprocess": False, "timeout": None})
+    results = _execute_compiled(
+        lambda: compiled, functions, context_variables, safe, limits
+    )
+    connection.send(
+        FunctionResults(
+            results={k: _picklable(v) for k, v in results.results.items()},
+            data={k: _picklable(v) for k, v in results.data.items()},
+            errors=results.errors,
+        )
+    )
+    connection.close()
+
+
+def _execute_in_subprocess(
+    code: str,
+    functions: List[Callable],
+    context_variables: Dict[str, Any],
+    safe: bool,
+    parallel: bool,
+    limits: ExecutionLimits,
+) -> FunctionResults:
+    """
+    Execute code in a forked process with CPU and memory limits, killing it once the
+    completion timeout is reached. Tools run in the child, so their side effects on
+    the parent's objects are lost, and unpicklable results are returned as reprs.
+    """
+    try:
+        compiled = _compile_sync(code, functions, parallel)
+    except Exception as e:
+        return FunctionResults(results={}, data={}, errors=[str(e) or repr(e)])
+    ctx = multiprocessing.get_context("fork")
+    receiver, sender = ctx.Pipe(duplex=False)
+    process = ctx.Process(
+        target=_run_child,
+        args=(sender, compiled, functions, context_variables, safe, limits),
+        daemon=True,
+    )
+    process.start()
+    sender.close()
+    try:
+        if receiver.poll(limits.timeout):
+            try:
+                return receiver.recv()
+            except EOFError:
+                # Exited without sending its results.
+                process.join()
+        if process.is_alive():
+            error = str(ExecutionTimeoutError("completion", limits.timeout))
+        elif limits.cpu_seconds is not None and process.exitcode in (
+            -signal.SIGXCPU,
+            -signal.SIGKILL,
+        ):
+            error = str(ExecutionTimeoutError("cpu", limits.cpu_seconds))
+        else:
+            error = f"Execution subprocess exited with code {process.exitcode}"
+        return FunctionResults(results={}, data={}, errors=[error])
+    finally:
+        receiver.close()
+        if process.is_alive():
+            process.kill()
+        process.join()
+
+
+def _in_source_order(
+    items: Dict[str, Any], positions: Optional[Dict[str, Tuple[int, int]]]
+) -> Dict[str, Any]:
+    """Order items by the source position of their name, if the code was reordered."""
+    if positions is None:
+        return items
+    # Names without a position, such as context variables, keep their place first.
+    return dict(sorted(items.items(), key=lambda item: positions.get(item[0], (0, 0))))
 
 
 def _match_results_to_variables(call_results: Dict, variables: Dict) -> None:
@@ -103,6 +626,8 @@ def execute_python_code(
     functions: List[Callable] = [],
     context_variables: Dict[str, Any] = {},
     safe: bool = False,
+    parallel: bool = True,
+    limits: Optional[ExecutionLimits] = None,
 ) -> FunctionResults:
     """
     Execute Python code with given functions and context variables.
@@ -112,36 +637,80 @@ def execute_python_code(
         functions: List of functions to make available to the code.
         context_variables: Variables to make available to the code.
         safe: Whether to sandbox the execution environment.
+        parallel: Whether to make independent tool calls concurrently on threads.
+        limits: Timeouts of the tool calls and of the whole code, and resource limits
+            of a subprocess running it.
 
     Returns:
         FunctionResults containing results, variables and any errors.
     """
+    if limits is not None and limits.subprocess:
+        return _execute_in_subprocess(
+            code, functions, context_variables, safe, parallel, limits
+        )
+    return _execute_compiled(
+        partial(_compile_sync, code, functions, parallel),
+        functions,
+        context_variables,
+        safe,
+        limits,
+    )
+
+
+def _compile_sync(code: str, functions: List[Callable], parallel: bool) -> _Compiled:
+    if parallel:
+        return _compile(code, "sync", tools=frozenset(f.__name__ for f in functions))
+    return _compile(code, "plain")
+
+
+def _execute_compiled(
+    compile_code: Callable[[], _Compiled],
+    functions: List[Callable],
+    context_variables: Dict[str, Any],
+    safe: bool,
+    limits: Optional[ExecutionLimits],
+) -> FunctionResults:
+    """Execute the code compile_code returns, its compile errors are reported too."""
     env = _create_execution_env(safe)
-    initial_keys = set(env.keys())
 
     if context_variables and isinstance(context_variables, dict):
         env.update(context_variables)
 
-    call_results = {}
+    log = _CallLog()
     errors = []
+    budget = _Budget(limits)
 
     for func in functions:
         env[func.__name__] = _make_sync_wrapper(
-            func.__name__, func, call_results, errors
+            func.__name__, func, log, errors, budget
         )
+    env[PARALLEL_NAME] = partial(_parallel_calls, log)
 
-    _setup_env_imports(env)
-
+    positions = None
     try:
-        exec(code, env)
+        compiled = compile_code()
+        positions = compiled.positions
+        if budget.timeout is None:
+            exec(compiled.code, env)
+        else:
+            # The code runs on a thread abandoned once the timeout is reached, its
+            # variables are those assigned by then.
+            future = _start_daemon(partial(exec, compiled.code, env))
+            try:
+                future.result(timeout=budget.timeout)
+            except TimeoutError:
+                if future.done():
+                    raise
+                env = dict(env)
+                raise ExecutionTimeoutError("completion", budget.timeout)
+    except ExecutionTimeoutError as e:
+        _add_error(errors, str(e))
     except Exception as e:
-        errors.append(str(e))
+        # Some errors, such as MemoryError, have no message.
+        errors.append(str(e) or repr(e))
 
-    variables = {
-        k: v
-        for k, v in env.items()
-        if k not in initial_keys and not k.startswith("__") and not callable(v)
-    }
+    variables = _in_source_order(_new_variables(env, _base_env(safe)), positions)
+    call_results = _in_source_order(log.results(), positions)
 
     _match_results_to_variables(call_results, variables)
 
@@ -153,6 +722,8 @@ async def async_execute_python_code(
     functions: List[Callable] = [],
     context_variables: Dict[str, Any] = {},
     safe: bool = False,
+    parallel: bool = True,
+    limits: Optional[ExecutionLimits] = None,
 ) -> FunctionResults:
     """
     Asynchronously execute Python code with given functions and context variables.
@@ -162,45 +733,80 @@ async def async_execute_python_code(
         functions: List of functions to make available to the code.
         context_variables: Variables to make available to the code.
         safe: Whether to sandbox the execution environment.
+        parallel: Whether to make independent tool calls concurrently, coroutine
+            tools with asyncio.gather and the others on threads.
+        limits: Timeouts of the tool calls and of the whole code, and resource limits
+            of a subprocess running it. Coroutine tools are cancelled on timeout.
 
     Returns:
         FunctionResults containing results, variables and any errors.
     """
+    if limits is not None and limits.subprocess:
+        if any(asyncio.iscoroutinefunction(func) for func in functions):
+            raise ValueError("Coroutine tools cannot run in a subprocess")
+        return await asyncio.to_thread(
+            _execute_in_subprocess,
+            code,
+            functions,
+            context_variables,
+            safe,
+            parallel,
+            limits,
+        )
+
     env = _create_execution_env(safe)
-    initial_keys = set(env.keys())
 
     if context_variables and isinstance(context_variables, dict):
         env.update(context_variables)
 
-    call_results = {}
+    log = _CallLog()
     errors = []
-    env["asyncio"] = asyncio
+    budget = _Budget(limits)
 
+    wrappers = {}
     for func in functions:
-        wrapper = await _make_async_wrapper(func.__name__, func, call_results, errors)
-        env[func.__name__] = wrapper
-        if asyncio.iscoroutinefunction(func):
-            code = code.replace(func.__name__, f"await {func.__name__}")
-
-    _setup_env_imports(env)
+        wrapper = await _make_async_wrapper(func.__name__, func, log, errors, budget)
+        env[func.__name__] = wrappers[func.__name__] = wrapper
+    env[GATHER_NAME] = partial(_gather_calls, log)
+    env[OFFLOAD_NAME] = _offload
+    coroutines = frozenset(
+        name
+        for name, wrapper in wrappers.items()
+        if asyncio.iscoroutinefunction(wrapper)
+    )
+    tools = frozenset(wrappers) if parallel else frozenset()
 
+    # Locals of the code, stored even when it fails.
+    async_locals = env[ASYNC_LOCALS_NAME] = {}
+    positions = None
     try:
-        async_code = "async def __async_exec():\n"
-        async_code += "".join(f"    {line}\n" for line in code.splitlines())
-        async_code += "\n    return locals()"
-
         exec_globals = {}
-        exec(async_code, env, exec_globals)
-        result = await exec_globals["__async_exec"]()
-        env.update(result)
+        compiled = _compile(
+            code, "async", coroutines, tools, frozenset(wrappers) - coroutines
+        )
+        positions = compiled.positions
+        exec(compiled.code, env, exec_globals)
+        if budget.timeout is None:
+            await exec_globals[ASYNC_EXEC_NAME]()
+        else:
+            try:
+                await asyncio.wait_for(exec_globals[ASYNC_EXEC_NAME](), budget.timeout)
+            except ExecutionTimeoutError:
+                raise
+            except asyncio.TimeoutError:
+                # Only the completion deadline, not a TimeoutError of a tool.
+                if time.monotonic() < budget.deadline:
+                    raise
+                raise ExecutionTimeoutError("completion", budget.timeout)
+    except ExecutionTimeoutError as e:
+        _add_error(errors, str(e))
     except Exception as e:
-        errors.append(str(e))
+        # Some errors, such as MemoryError, have no message.
+        errors.append(str(e) or repr(e))
+    env.update(async_locals)
 
-    variables = {
-        k: v
-        for k, v in env.items()
-        if k not in initial_keys and not k.startswith("__") and not callable(v)
-    }
+    variables = _in_source_order(_new_variables(env, _base_env(safe)), positions)
+    call_results = _in_source_order(log.results(), positions)
 
     _match_results_to_variables(call_results, variables)
 
@@ -211,6 +817,8 @@ def execute_tool_call(
     functions: List[Callable],
     completion: str,
     show_completion: bool = False,
+    limits: Optional[ExecutionLimits] = None,
+    parallel: bool = True,
 ) -> ExecutionResults:
     """
     Execute a tool call with the given functions and completion.
@@ -219,6 +827,9 @@ def execute_tool_call(
         functions: List of functions to make available.
         completion: Code completion to execute.
         show_completion: Whether to log the completion.
+        limits: Execution budgets, exceeded ones are reported in the errors.
+        parallel: Whether independent tool calls run concurrently, False runs the
+            calls one after the other as written, e.g. when they have side effects.
 
     Returns:
         ExecutionResults containing the execution outcome.
@@ -231,7 +842,7 @@ def execute_tool_call(
             logger.info(f"Completion: {completion}")
 
         code = extract_codeblocks(completion) if "```" in completion else completion
-        results = execute_python_code(code, functions)
+        results = execute_python_code(code, functions, parallel=parallel, limits=limits)
         errors.extend(results.errors)
 
     except Exception as e:
@@ -250,6 +861,8 @@ async def async_execute_tool_call(
     functions: List[Callable],
     completion: str,
     show_completion: bool = False,
+    limits: Optional[ExecutionLimits] = None,
+    parallel: bool = True,
 ) -> ExecutionResults:
     """
     Asynchronously execute a tool call with the given functions and completion.
@@ -258,6 +871,9 @@ async def async_execute_tool_call(
         functions: List of functions to make available.
         completion: Code completion to execute.
         show_completion: Whether to log the completion.
+        limits: Execution budgets, exceeded ones are reported in the errors.
+        parallel: Whether independent tool calls run concurrently, False runs the
+            calls one after the other as written, e.g. when they have side effects.
 
     Returns:
         ExecutionResults containing the execution outcome.
@@ -270,7 +886,9 @@ async def async_execute_tool_call(
             logger.info(f"Completion: {completion}")
 
         code = extract_codeblocks(completion) if "```" in completion else completion
-        results = await async_execute_python_code(code, functions)
+        results = await async_execute_python_code(
+            code, functions, parallel=parallel, limits=limits
+        )
         errors.extend(results.errors)
 
     except Exception as e:
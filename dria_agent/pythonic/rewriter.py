@@ -0,0 +1,391 @@
+"""
+AST rewriting of completions for concurrent and asynchronous execution.
+
+Tiny-Agent models emit parallel tool calls as sequential statements. The top-level
+statements of a completion are scheduled on a dependency graph of the variables they
+read and write, and tool calls that do not depend on each other are made together::
+
+    weather = get_weather("Istanbul")        __calls_0 = __parallel_calls(
+    wiki = search_wikipedia("Istanbul")  ->      (get_weather, ("Istanbul",), {}),
+                                                 (search_wikipedia, ("Istanbul",), {}),
+                                             )
+                                             if __calls_0.ok(0):
+                                                 weather = __calls_0[0]
+                                             if __calls_0.ok(1):
+                                                 wiki = __calls_0[1]
+                                             __calls_0.reraise()
+
+The runner returns the result of every call with ok(i), telling whether call i
+succeeded, and reraise(), raising the first failure. The calls that succeeded are
+bound before a failure is raised, as they would be when running line by line.
+
+For asynchronous execution the code is moved into an ``async def`` awaiting the calls
+of coroutine tools, and of synchronous tools run off the event loop. Concurrent calls
+are awaited with ``await __gather_calls(...)``.
+"""
+
+import ast
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+ASYNC_EXEC_NAME = "__async_exec"
+ASYNC_LOCALS_NAME = "__async_locals"
+GATHER_NAME = "__gather_calls"
+OFFLOAD_NAME = "__offload"
+PARALLEL_NAME = "__parallel_calls"
+
+
+class AwaitCoroutineCalls(ast.NodeTransformer):
+    """
+    Await the calls of the given coroutine functions, and make the calls of the given
+    synchronous functions ``await __offload(f)(...)``, awaiting f run off the event
+    loop. Calls inside nested synchronous functions and lambdas, where await is not
+    allowed, are left untouched, and so are synchronous calls in generator
+    expressions, which await would turn into async generators.
+    """
+
+    def __init__(
+        self, coroutines: FrozenSet[str], offloaded: FrozenSet[str] = frozenset()
+    ):
+        self.coroutines = coroutines
+        self.offloaded = offloaded
+
+    def _is_coroutine_call(self, node: ast.AST) -> bool:
+        return (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id in self.coroutines
+        )
+
+    def visit_Await(self, node: ast.Await) -> ast.Await:
+        # Already awaited, only rewrite the arguments.
+        if self._is_coroutine_call(node.value):
+            node.value = self.generic_visit(node.value)
+            return node
+        return self.generic_visit(node)
+
+    def visit_Call(self, node: ast.Call) -> ast.AST:
+        node = self.generic_visit(node)
+        if self._is_coroutine_call(node):
+            return ast.copy_location(ast.Await(value=node), node)
+        if isinstance(node.func, ast.Name) and node.func.id in self.offloaded:
+            node.func = ast.Call(
+                func=ast.Name(id=OFFLOAD_NAME, ctx=ast.Load()),
+                args=[node.func],
+                keywords=[],
+            )
+            return ast.copy_location(ast.Await(value=node), node)
+        return node
+
+    def visit_GeneratorExp(self, node: ast.GeneratorExp) -> ast.GeneratorExp:
+        offloaded, self.offloaded = self.offloaded, frozenset()
+        try:
+            return self.generic_visit(node)
+        finally:
+            self.offloaded = offloaded
+
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> ast.FunctionDef:
+        return node
+
+    def visit_Lambda(self, node: ast.Lambda) -> ast.Lambda:
+        return node
+
+
+# Expressions that may have side effects or bind names, their statements are barriers.
+_EFFECTS = (ast.Call, ast.Await, ast.NamedExpr, ast.Yield, ast.YieldFrom)
+
+
+@dataclass
+class _Node:
+    index: int
+    stmt: ast.stmt
+    reads: Set[str]
+    writes: Set[str]
+    # (target, call) of a tool call statement, None otherwise.
+    call: Optional[Tuple[Optional[str], ast.Call]] = None
+    barrier: bool = False
+    level: int = 0
+    # Emitted after the tool calls of its level, as one of them comes before it.
+    deferred: bool = False
+
+
+def _names(node: ast.AST, ctx: type) -> Set[str]:
+    return {
+        n.id
+        for n in ast.walk(node)
+        if isinstance(n, ast.Name) and isinstance(n.ctx, ctx)
+    }
+
+
+def _target_names(targets: List[ast.expr]) -> Optional[Set[str]]:
+    """Names bound by assignment targets, None if a target is not a plain name."""
+    names = set()
+    for target in targets:
+        for n in ast.walk(target):
+            if isinstance(n, (ast.Attribute, ast.Subscript)):
+                return None
+            if isinstance(n, ast.Name):
+                names.add(n.id)
+    return names
+
+
+def _tool_call(
+    stmt: ast.stmt, tools: FrozenSet[str]
+) -> Optional[Tuple[Optional[str], ast.Call]]:
+    """
+    (target, call) if stmt is ``target = tool(...)`` or ``tool(...)``, awaited or not,
+    with arguments that call nothing and can be evaluated ahead of the call.
+    """
+    if isinstance(stmt, ast.Assign):
+        if len(stmt.targets) != 1 or not isinstance(stmt.targets[0], ast.Name):
+            return None
+        target = stmt.targets[0].id
+    elif isinstance(stmt, ast.Expr):
+        target = None
+    else:
+        return None
+    call = stmt.value.value if isinstance(stmt.value, ast.Await) else stmt.value
+    if not (
+        isinstance(call, ast.Call)
+        and isinstance(call.func, ast.Name)
+        and call.func.id in tools
+    ):
+        return None
+    for arg in call.args + [k.value for k in call.keywords]:
+        if any(isinstance(n, _EFFECTS + (ast.Lambda,)) for n in ast.walk(arg)):
+            return None
+    return target, call
+
+
+def _node(index: int, stmt: ast.stmt, tools: FrozenSet[str]) -> Optional[_Node]:
+    """Graph node of a simple statement, None for compound statements."""
+    if isinstance(stmt, ast.Assign):
+        writes = _target_names(stmt.targets)
+        if writes is None:
+            return None
+    elif isinstance(stmt, ast.Expr):
+        writes = set()
+    else:
+        return None
+    node = _Node(index, stmt, _names(stmt.value, ast.Load), writes)
+    node.call = _tool_call(stmt, tools)
+    node.barrier = node.call is None and any(
+        isinstance(n, _EFFECTS) for n in ast.walk(stmt.value)
+    )
+    return node
+
+
+def _depends(later: _Node, earlier: _Node) -> bool:
+    if later.barrier or earlier.barrier:
+        return True
+    return bool(
+        earlier.writes & later.reads
+        or earlier.reads & later.writes
+        or earlier.writes & later.writes
+    )
+
+
+def _concurrent(group: List[_Node], runner: str, awaited: bool) -> List[ast.stmt]:
+    outcomes = f"__calls_{group[0].index}"
+    calls = [
+        ast.Tuple(
+            elts=[
+                call.func,
+                ast.Tuple(elts=call.args, ctx=ast.Load()),
+                ast.Dict(
+                    keys=[
+                        ast.Constant(k.arg) if k.arg else None for k in call.keywords
+                    ],
+                    values=[k.value for k in call.keywords],
+                ),
+            ],
+            ctx=ast.Load(),
+        )
+        for call in (node.call[1] for node in group)
+    ]
+    value = ast.Call(func=ast.Name(id=runner, ctx=ast.Load()), args=calls, keywords=[])
+    statements = [
+        ast.Assign(
+            targets=[ast.Name(id=outcomes, ctx=ast.Store())],
+            value=ast.Await(value=value) if awaited else value,
+        )
+    ]
+    for i, node in enumerate(group):
+        if node.call[0] is None:
+            continue
+        statements.append(
+            ast.If(
+                test=_method_call(outcomes, "ok", ast.Constant(i)),
+                body=[
+                    ast.Assign(
+                        targets=[ast.Name(id=node.call[0], ctx=ast.Store())],
+                        value=ast.Subscript(
+                            value=ast.Name(id=outcomes, ctx=ast.Load()),
+                            slice=ast.Constant(i),
+                            ctx=ast.Load(),
+                        ),
+                    )
+                ],
+                orelse=[],
+            )
+        )
+    statements.append(ast.Expr(value=_method_call(outcomes, "reraise")))
+    return [ast.copy_location(stmt, group[0].stmt) for stmt in statements]
+
+
+def _method_call(name: str, method: str, *args: ast.expr) -> ast.Call:
+    return ast.Call(
+        func=ast.Attribute(
+            value=ast.Name(id=name, ctx=ast.Load()), attr=method, ctx=ast.Load()
+        ),
+        args=list(args),
+        keywords=[],
+    )
+
+
+def _schedule_segment(
+    nodes: List[_Node], runner: str, awaited: bool
+) -> Tuple[List[ast.stmt], bool]:
+    """
+    Emit the statements of a run of simple statements level by level of their
+    dependency graph, with the tool calls of a level made concurrently. Only tool
+    calls, barriers and deferred statements start a new level. The other
+    statements are cheap and run before the calls of their level, unless one of
+    those calls comes before them in the source, in which case they are deferred
+    until after the calls so that a failure leaves the earlier calls made.
+    """
+    for j, later in enumerate(nodes):
+        for earlier in nodes[:j]:
+            if _depends(later, earlier):
+                step = earlier.call is not None or earlier.barrier or earlier.deferred
+                later.level = max(later.level, earlier.level + step)
+        if later.call is None:
+            later.deferred = any(
+                earlier.call is not None and earlier.level == later.level
+                for earlier in nodes[:j]
+            )
+
+    emitted: List[ast.stmt] = []
+    order: List[int] = []
+    for level in sorted({node.level for node in nodes}):
+        members = [node for node in nodes if node.level == level]
+        calls = [node for node in members if node.call is not None]
+        for node in members:
+            if node.call is None and not node.deferred:
+                emitted.append(node.stmt)
+                order.append(node.index)
+        if len(calls) > 1:
+            emitted.extend(_concurrent(calls, runner, awaited))
+        else:
+            emitted.extend(node.stmt for node in calls)
+        order.extend(node.index for node in calls)
+        for node in members:
+            if node.deferred:
+                emitted.append(node.stmt)
+                order.append(node.index)
+    return emitted, order != sorted(order)
+
+
+@dataclass
+class Rewrite:
+    """
+    Rewritten completion.
+
+    :param tree: Module to compile.
+    :param positions: When statements were reordered, the source position of the first
+        assignment of each variable and the first call of each tool, to restore the
+        order results would have when running the code line by line. None otherwise.
+    """
+
+    tree: ast.Module
+    positions: Optional[Dict[str, Tuple[int, int]]] = None
+
+
+def _source_positions(tree: ast.Module, tools: FrozenSet[str]):
+    positions: Dict[str, Tuple[int, int]] = {}
+    for n in ast.walk(tree):
+        if isinstance(n, ast.Name) and (isinstance(n.ctx, ast.Store) or n.id in tools):
+            position = (n.lineno, n.col_offset)
+            positions[n.id] = min(positions.get(n.id, position), position)
+    return positions
+
+
+def schedule_calls(
+    tree: ast.Module, tools: FrozenSet[str], runner: str, awaited: bool = False
+) -> Rewrite:
+    """
+    Make independent tool calls among the top-level statements of a module concurrent.
+
+    Assignments and expressions form the nodes of a dependency graph, with edges for
+    the variables they read and write. Other statements, and statements calling
+    anything but a tool with call-free arguments, keep their place in the code.
+
+    :param tree: Parsed completion, rewritten in place.
+    :param tools: Names of the tools.
+    :param runner: Name of the function making (func, args, kwargs) calls concurrently,
+        returning their outcomes as described in the module docstring.
+    :param awaited: Whether the runner returns an awaitable.
+    """
+    body: List[ast.stmt] = []
+    segment: List[_Node] = []
+    reordered = False
+
+    def flush():
+        nonlocal reordered
+        if sum(node.call is not None for node in segment) > 1:
+            statements, moved = _schedule_segment(segment, runner, awaited)
+            body.extend(statements)
+            reordered = reordered or moved
+        else:
+            body.extend(node.stmt for node in segment)
+        segment.clear()
+
+    positions = _source_positions(tree, tools)
+    for index, stmt in enumerate(tree.body):
+        node = _node(index, stmt, tools)
+        if node is None:
+            flush()
+            body.append(stmt)
+        else:
+            segment.append(node)
+    flush()
+    tree.body = body
+    return Rewrite(ast.fix_missing_locations(tree), positions if reordered else None)
+
+
+def rewrite_sync(code: str, tools: FrozenSet[str]) -> Rewrite:
+    """Module running code with independent tool calls made on threads."""
+    return schedule_calls(ast.parse(code, "<string>"), tools, PARALLEL_NAME)
+
+
+def rewrite_async(
+    code: str,
+    coroutines: FrozenSet[str],
+    tools: FrozenSet[str] = frozenset(),
+    offloaded: FrozenSet[str] = frozenset(),
+) -> Rewrite:
+    """
+    Module defining ``async def __async_exec()`` running code, with calls of the
+    coroutine tools awaited and independent tool calls gathered. Its locals are
+    stored in the ``__async_locals`` dict, even when it fails.
+
+    :param coroutines: Names of the coroutine tools.
+    :param tools: Names of the tools whose independent calls are gathered, the
+        synchronous ones on threads. Empty to keep every call in place.
+    :param offloaded: Names of the synchronous tools whose calls are awaited off the
+        event loop.
+    """
+    rewrite = schedule_calls(
+        ast.parse(code, "<string>"), tools, GATHER_NAME, awaited=True
+    )
+    tree = AwaitCoroutineCalls(coroutines, offloaded).visit(rewrite.tree)
+    module = ast.parse(
+        f"async def {ASYNC_EXEC_NAME}():\n"
+        "    try:\n"
+        "        pass\n"
+        "    finally:\n"
+        f"        {ASYNC_LOCALS_NAME}.update(locals())"
+    )
+    module.body[0].body[0].body = tree.body
+    rewrite.tree = ast.fix_missing_locations(module)
+    return rewrite
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Dict, Any, List
+from pydantic import BaseModel, model_validator
+from typing import Dict, Any, List, Literal, Optional
 import json
 
 
@@ -11,12 +11,40 @@ class FunctionResults(BaseModel):
     errors: List[str]
 
 
+class ExecutionLimits(BaseModel):
+    """
+    Execution budgets of a completion. Exceeded budgets are reported in
+    ExecutionResults.errors as "TimeoutError: ..." entries.
+
+    timeout: wall-clock seconds for the whole completion.
+    tool_timeout: wall-clock seconds for each tool call, coroutine tools are cancelled.
+    subprocess: run the completion in a forked process, killed once timeout is reached,
+        which is then required. Only synchronous tools can be used.
+    cpu_seconds: CPU time limit of the subprocess.
+    memory_bytes: address space limit of the subprocess.
+    """
+
+    timeout: Optional[float] = None
+    tool_timeout: Optional[float] = None
+    subprocess: bool = False
+    cpu_seconds: Optional[int] = None
+    memory_bytes: Optional[int] = None
+
+    @model_validator(mode="after")
+    def _subprocess_timeout(self) -> "ExecutionLimits":
+        # A subprocess stuck in a hung tool would otherwise be waited for forever.
+        if self.subprocess and self.timeout is None:
+            raise ValueError("subprocess=True requires a timeout")
+        return self
+
+
 class ExecutionResults(BaseModel):
     results: Dict[str, Any]
     data: Dict[str, Any]
     errors: List[str]
     content: str
     is_dry: bool
+    metrics: Optional[Dict[str, Any]] = None
 
     def dict(self, *args, **kwargs):
         if self.is_dry:
@@ -36,3 +64,16 @@ class ExecutionResults(BaseModel):
         if not self.data or (len(self.data) == 1 and "re" in self.data):
             return None
         return list(self.data.values())[-1]
+
+
+class StreamEvent(BaseModel):
+    """
+    Event of a streamed run.
+
+    token: a chunk of generated text. code_ready: the completion up to the end of its
+    code block, execution starts now. tool_result: the value a tool call produced.
+    final: the ExecutionResults of the run.
+    """
+
+    type: Literal["token", "code_ready", "tool_result", "final"]
+    data: Any
@@ -1,4 +1,4 @@
-from typing import List, Callable, Dict, Any, get_type_hints, Union
+from typing import List, Callable, Dict, Any, get_type_hints, Union, Optional
 import inspect
 import re
 import logging
@@ -59,6 +59,23 @@ def extract_codeblocks(text: str) -> List[str]:
     return "\n".join(code_blocks) if code_blocks else ""
 
 
+def code_block_end(text: str) -> Optional[int]:
+    """
+    Find where the first python code block of a (partial) completion ends.
+
+    Args:
+        text: The completion generated so far
+
+    Returns:
+        Index just past the closing fence, or None while the block is not closed yet
+    """
+    start = text.find("```python")
+    if start == -1:
+        return None
+    end = text.find("```", start + len("```python"))
+    return end + len("```") if end != -1 else None
+
+
 def load_system_prompt(file_path: str) -> str:
     """
     Load the system prompt from a given file and return it as a string.
@@ -0,0 +1,295 @@
+"""
+Long-running HTTP server keeping a ToolCallingAgent warm across requests.
+
+Endpoints (JSON in, JSON out):
+
+    POST /run           {"query": str, "dry_run": bool, "num_tools": int}
+    POST /run_feedback  {"query": str, "num_tools": int, "max_iterations": int}
+    POST /instruct      {"query": str}
+    GET  /health
+    GET  /metrics       Prometheus text format
+"""
+
+import asyncio
+import json
+import logging
+import signal
+import time
+from http import HTTPStatus
+from typing import Any, Dict, Optional, Set, Tuple
+
+from dria_agent.agent.metrics import METRICS
+from dria_agent.pythonic.schemas import ExecutionResults
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 1 << 20
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _execution_to_json(execution: ExecutionResults) -> Dict[str, Any]:
+    return {
+        "content": execution.content,
+        "final_answer": execution.final_answer(),
+        "results": execution.results,
+        "errors": execution.errors,
+        "is_dry": execution.is_dry,
+        "metrics": execution.metrics,
+    }
+
+
+class AgentServer:
+    """
+    Serve a ToolCallingAgent over HTTP with a bounded number of concurrent runs.
+
+    Requests beyond max_concurrency wait in a queue, and are rejected with 503 once
+    max_queue requests are waiting. On shutdown the listener is closed first and
+    in-flight requests get shutdown_timeout seconds to finish.
+
+    Args:
+        agent: The agent to serve
+        host: Interface to bind
+        port: Port to bind
+        max_concurrency: Maximum number of requests processed at once
+        max_queue: Maximum number of requests waiting for a slot
+        shutdown_timeout: Seconds to wait for in-flight requests on shutdown
+    """
+
+    def __init__(
+        self,
+        agent,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        max_concurrency: int = 4,
+        max_queue: int = 64,
+        shutdown_timeout: float = 30.0,
+    ):
+        self.agent = agent
+        self.host = host
+        self.port = port
+        self.max_queue = max_queue
+        self.shutdown_timeout = shutdown_timeout
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._in_flight = 0
+        self._handlers: Set[asyncio.Task] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._stopped = asyncio.Event()
+        self.routes = {
+            ("POST", "/run"): self._run,
+            ("POST", "/run_feedback"): self._run_feedback,
+            ("POST", "/instruct"): self._instruct,
+        }
+
+    async def _run(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        execution = await self.agent.async_run(
+            self._query(body),
+            dry_run=bool(body.get("dry_run", False)),
+            show_completion=False,
+            num_tools=int(body.get("num_tools", 2)),
+            print_results=False,
+            parallel=None if body.get("parallel") is None else bool(body["parallel"]),
+        )
+        return _execution_to_json(execution)
+
+    async def _run_feedback(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        execution = await self.agent.async_run_feedback(
+            self._query(body),
+            show_completion=False,
+            num_tools=int(body.get("num_tools", 2)),
+            print_results=False,
+            max_iterations=int(body.get("max_iterations", 3)),
+        )
+        return _execution_to_json(execution)
+
+    async def _instruct(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        content = await self.agent.async_instruct(
+            self._query(body), show_completion=False
+        )
+        return {"content": content}
+
+    def _health(self) -> Dict[str, Any]:
+        return {
+            "status": "ok",
+            "in_flight": self._in_flight,
+            "queue_depth": self._waiting,
+        }
+
+    @staticmethod
+    def _query(body: Dict[str, Any]) -> str:
+        query = body.get("query")
+        if not isinstance(query, str) or not query:
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, "'query' must be a non-empty string"
+            )
+        return query
+
+    def _update_gauges(self) -> None:
+        METRICS.set("dria_agent_server_queue_depth", self._waiting)
+        METRICS.set("dria_agent_server_in_flight", self._in_flight)
+
+    async def _dispatch(self, handler, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a handler once a concurrency slot is free"""
+        if self._slots.locked() and self._waiting >= self.max_queue:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Request queue is full")
+        self._waiting += 1
+        self._update_gauges()
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+        self._update_gauges()
+        try:
+            return await handler(body)
+        finally:
+            self._in_flight -= 1
+            self._update_gauges()
+            self._slots.release()
+
+    @staticmethod
+    async def _read_request(
+        reader: asyncio.StreamReader,
+    ) -> Optional[Tuple[str, str, bytes]]:
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+
+        headers = {}
+        while True:
+            header = await reader.readline()
+            if header in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = header.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], body
+
+    @staticmethod
+    async def _write_response(
+        writer: asyncio.StreamWriter,
+        status: HTTPStatus,
+        body: bytes,
+        content_type: str = "application/json",
+    ) -> None:
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def _respond(
+        self, reader: asyncio.StreamReader
+    ) -> Tuple[HTTPStatus, bytes, str, str]:
+        """Read one request and build (status, payload, content type, route label)"""
+        route = "other"
+        try:
+            request = await self._read_request(reader)
+            if request is None:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Empty request")
+            method, path, raw = request
+            if method == "GET" and path == "/metrics":
+                payload = METRICS.to_prometheus().encode("utf-8")
+                return HTTPStatus.OK, payload, "text/plain; version=0.0.4", path
+            if method == "GET" and path == "/health":
+                payload = json.dumps(self._health()).encode("utf-8")
+                return HTTPStatus.OK, payload, "application/json", path
+
+            handler = self.routes.get((method, path))
+            if handler is None:
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"No route for {method} {path}")
+            route = path
+            try:
+                body = json.loads(raw) if raw else {}
+            except json.JSONDecodeError as e:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"Invalid JSON: {e}")
+            if not isinstance(body, dict):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+            result = await self._dispatch(handler, body)
+            status = HTTPStatus.OK
+        except HTTPError as e:
+            status, result = e.status, {"error": str(e)}
+        except (asyncio.IncompleteReadError, ValueError) as e:
+            status, result = HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except Exception as e:
+            logger.exception(f"Request to {route} failed")
+            status, result = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)}
+        payload = json.dumps(result, default=str).encode("utf-8")
+        return status, payload, "application/json", route
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        start = time.perf_counter()
+        try:
+            status, payload, content_type, route = await self._respond(reader)
+            await self._write_response(writer, status, payload, content_type)
+            METRICS.inc(
+                "dria_agent_server_requests_total", path=route, status=status.value
+            )
+            METRICS.observe(
+                "dria_agent_server_request_seconds",
+                time.perf_counter() - start,
+                path=route,
+            )
+        except ConnectionError:
+            pass
+        finally:
+            self._handlers.discard(task)
+            writer.close()
+
+    async def start(self) -> None:
+        """Connect MCP servers and start listening."""
+        await self.agent.initialize_servers()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self._update_gauges()
+        logger.info(f"Serving dria_agent on http://{self.host}:{self.port}")
+
+    def stop(self) -> None:
+        """Request a graceful shutdown."""
+        self._stopped.set()
+
+    async def shutdown(self) -> None:
+        """Stop accepting connections, drain in-flight requests and close MCP servers."""
+        if self._server is not None:
+            self._server.close()
+        if self._handlers:
+            logger.info(f"Waiting for {len(self._handlers)} in-flight requests")
+            _, pending = await asyncio.wait(
+                set(self._handlers), timeout=self.shutdown_timeout
+            )
+            for task in pending:
+                task.cancel()
+        await self.agent.close_servers()
+
+    async def serve_forever(self) -> None:
+        """Serve until SIGINT/SIGTERM or stop(), then shut down gracefully."""
+        await self.start()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        try:
+            await self._stopped.wait()
+        finally:
+            await self.shutdown()